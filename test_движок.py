@@ -0,0 +1,123 @@
+"""Сверка быстрых проверок допустимости хода и счетчиков клеток с прямой проверкой по клеткам доски.
+
+Запуск: python -m pytest -q
+"""
+import numpy as np
+import pytest
+
+from движок import Bitboards, Engine, dice_stream, legal_mask
+
+
+def brute_force_fits(board, x, y, width, height, player_id):
+    """Правило хода клетка за клеткой, как в первой версии can_place"""
+    size_y, size_x = board.shape
+    if x < 0 or y < 0 or x + width > size_x or y + height > size_y:
+        return False
+    if board[y:y + height, x:x + width].any():
+        return False
+    # Хотя бы одна сторона целиком примыкает к клеткам игрока
+    if x > 0 and all(board[i, x - 1] == player_id for i in range(y, y + height)):
+        return True
+    if x + width < size_x and all(board[i, x + width] == player_id for i in range(y, y + height)):
+        return True
+    if y > 0 and all(board[y - 1, j] == player_id for j in range(x, x + width)):
+        return True
+    return y + height < size_y and all(board[y + height, j] == player_id for j in range(x, x + width))
+
+
+def random_board(rng, size, num_players=3):
+    """Поле со случайными прямоугольниками игроков и отдельными клетками, как после эндгейма"""
+    board = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(size * 2):
+        width, height = rng.integers(1, 5, size=2)
+        x, y = rng.integers(0, size, size=2)
+        if x + width <= size and y + height <= size and not board[y:y + height, x:x + width].any():
+            board[y:y + height, x:x + width] = rng.integers(1, num_players + 1)
+    cells = rng.random((size, size)) < 0.05
+    board[cells & (board == 0)] = rng.integers(1, num_players + 1)
+    return board
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_legal_mask_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    board = random_board(rng, int(rng.integers(4, 16)))
+    size = board.shape[0]
+    for width in range(1, 6):
+        for height in range(1, 6):
+            for player_id in (1, 2, 3):
+                mask = legal_mask(board, width, height, player_id)
+                expected = np.array([[brute_force_fits(board, x, y, width, height, player_id)
+                                      for x in range(size - width + 1)]
+                                     for y in range(size - height + 1)], dtype=bool).reshape(mask.shape)
+                assert np.array_equal(mask, expected), (width, height, player_id)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_bitboards_match_legal_mask(seed):
+    rng = np.random.default_rng(seed)
+    board = random_board(rng, int(rng.integers(4, 16)))
+    size = board.shape[0]
+    bitboards = Bitboards(size, 3)
+    for player_id in (1, 2, 3):
+        bitboards.add_mask(player_id, board == player_id)
+    for width in range(1, 6):
+        for height in range(1, 6):
+            for player_id in (1, 2, 3):
+                mask = legal_mask(board, width, height, player_id)
+                # За пределами маски фигура в поле не помещается
+                for y in range(-1, size + 1):
+                    for x in range(-1, size + 1):
+                        inside = 0 <= y < mask.shape[0] and 0 <= x < mask.shape[1]
+                        assert bitboards.fits(player_id, x, y, width, height) == (inside and mask[y, x]), \
+                            (x, y, width, height, player_id)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_can_place_matches_brute_force_during_game(seed):
+    engine = Engine(board_size=20, num_players=3, seed=seed)
+    engine.use_dice_stream(dice_stream(seed, 2000))
+    engine.start_game()
+    for turn in range(150):
+        if not engine.first_move[engine.current_player]:
+            player_id = engine.current_player + 1
+            width, height = engine.current_rect
+            for y in range(-1, engine.board_size + 1):
+                for x in range(-1, engine.board_size + 1):
+                    expected = brute_force_fits(engine.board, x, y, width, height, player_id)
+                    assert engine.can_place(x, y) == expected, (turn, x, y)
+        engine.bot_move()
+        if turn == 100:
+            # Дальше партия окончена: маски нет, can_place проверяет по битбордам
+            engine.handle_premature_endgame()
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_first_moves_do_not_overlap_on_small_board(seed):
+    # На поле 10x10 угловые фигуры четырех игроков размером до 6x6 могут задеть друг друга
+    engine = Engine(board_size=10, num_players=4, seed=seed)
+    engine.use_dice_stream(dice_stream(seed, 2000))
+    engine.start_game()
+    for _ in range(200):
+        engine.bot_move()
+    for player in range(engine.num_players):
+        assert engine.cell_counts[player] == np.count_nonzero(engine.board == player + 1)
+
+
+def assert_cell_counts(engine):
+    for player in range(engine.num_players):
+        assert engine.cell_counts[player] == np.count_nonzero(engine.board == player + 1), player
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cell_counts_follow_board(seed):
+    engine = Engine(board_size=30, num_players=3, seed=seed)
+    engine.use_dice_stream(dice_stream(seed, 2000))
+    engine.start_game()
+    for _ in range(120):
+        engine.bot_move()
+        assert_cell_counts(engine)
+    # Заблокированные клетки отходят блокирующему игроку, очки - по счетчикам
+    engine.handle_premature_endgame()
+    assert_cell_counts(engine)
+    assert engine.player_scores == engine.cell_counts
@@ -1,11 +1,15 @@
+import cProfile
+import os
 import pygame
-import random
 import sys
+import time
+import zipfile
+from collections import deque
 import numpy as np
-from collections import deque # Импортируем deque
-
-# Инициализация Pygame
-pygame.init()
+from движок import BotWorker, Engine
+from поиск import ExpectimaxBot, MCTSBot
+from запись import read_snapshot, restore_snapshot, save_snapshot
+from метрики import Metrics
 
 # Цвета
 BACKGROUND = (20, 20, 35)
@@ -21,40 +25,102 @@ WIN_COLOR = (255, 215, 0)
 
 # Настройки окна
 WIDTH, HEIGHT = 1200, 800
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Прямоугольные битвы")
-font = pygame.font.SysFont('Arial', 24)
-title_font = pygame.font.SysFont('Arial', 40, bold=True)
+BOT_POLL_MS = 50  # Как часто простаивающее окно проверяет, выбрал ли компьютер ход
+VIEW_SIZE = HEIGHT - 100  # Сторона области поля на экране, пикселей
+# Масштабы (пикселей на клетку); меньше 1 - огрубленная картинка, каждая клетка выборки на пиксель
+ZOOM_LEVELS = (0.125, 0.25, 0.5, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 14, 16, 20, 24, 32)
+DETAIL_ZOOM = 4  # С этого масштаба рисуются сетка и границы фигур
+# Незаконченная партия сохраняется сюда при выходе и каждые AUTOSAVE_TURNS ходов
+SAVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "сохранение.npz")
+AUTOSAVE_TURNS = 10
+# Панель производительности (F3): средние за последние PERF_FRAMES кадров по фазам основного цикла
+PERF_FRAMES = 60
+PERF_PHASES = ("события", "допустимые позиции", "бот", "сохранение", "отрисовка")
+PROFILE_SECONDS = 10  # Сколько пишется профиль по F4
+# Счетчики и время операций движка для долгих сессий: путь к *.csv или файлу Prometheus, пишутся раз в минуту
+METRICS_PATH = os.environ.get("BATTLES_METRICS")
+screen = None
+font = None
+title_font = None
+small_font = None
+
+def init_display():
+    """Инициализация Pygame и окна (не при импорте: процессы пула поиска импортируют этот модуль)"""
+    global screen, font, title_font, small_font
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Прямоугольные битвы")
+    font = pygame.font.SysFont('Arial', 24)
+    title_font = pygame.font.SysFont('Arial', 40, bold=True)
+    small_font = pygame.font.SysFont('Arial', 16)
+
+class FrameTimes:
+    """Время фаз основного цикла за последние PERF_FRAMES кадров"""
 
-class Game:
     def __init__(self):
+        self.history = {name: deque(maxlen=PERF_FRAMES) for name in PERF_PHASES}  # мс по кадрам
+        self.starts = deque(maxlen=PERF_FRAMES)  # Начала кадров - для числа кадров в секунду
+        self.current = dict.fromkeys(PERF_PHASES, 0.0)
+        self.mark = time.perf_counter()
+        self.nested = 0.0  # Время вложенных фаз с прошлой отметки
+
+    def start_frame(self):
+        self.current = dict.fromkeys(PERF_PHASES, 0.0)
+        self.mark = time.perf_counter()
+        self.nested = 0.0
+        self.starts.append(self.mark)
+
+    def phase(self, name):
+        """Относит к фазе name время с прошлой отметки, кроме вложенных фаз"""
+        now = time.perf_counter()
+        self.current[name] += now - self.mark - self.nested
+        self.mark = now
+        self.nested = 0.0
+
+    def add(self, name, seconds):
+        """Вложенная фаза: ее время не попадет в фазу, внутри которой она прошла"""
+        self.current[name] += seconds
+        self.nested += seconds
+
+    def end_frame(self):
+        for name, seconds in self.current.items():
+            self.history[name].append(seconds * 1000)
+
+    def averages(self):
+        return {name: sum(times) / len(times) if times else 0.0 for name, times in self.history.items()}
+
+    def fps(self):
+        if len(self.starts) < 2 or self.starts[-1] == self.starts[0]:
+            return 0.0
+        return (len(self.starts) - 1) / (self.starts[-1] - self.starts[0])
+
+class Game(Engine):
+    def __init__(self):
+        super().__init__()
         self.state = "menu"
-        self.board_size = 0
         self.cell_size = 0
-        self.board = None
-        self.players = []
-        self.current_player = 0
-        self.dice_result = (0, 0)
-        self.current_rect = None
         self.game_mode = ""
         self.offset_x = 0
         self.offset_y = 0
-        self.rotation = 0
-        self.placed_rects = {0: [], 1: []}
-        self.valid_positions = set()
         self.selected_size = 50
         self.selected_mode = ""
-        self.first_move = {0: True, 1: True}
-        self.skip_turn_available = False
-        self.game_over = False
-        self.winner = None
-        self.player_scores = [0, 0]
-        self.frontier_lines = []  # Для хранения линий передового контура
-        self.premature_endgame = False
-        self.blocked_cells = set()  # Клетки, заблокированные передовым контуром
-        self.piece_queue = []  # Очередь из 3 следующих фигур
-        self.max_queue_size = 3
-        self.num_players = 2  # 2, 3 или 4
+        self.selected_bot = "evaluate"  # Бот в режиме PvC: "evaluate", "mcts" или "expectimax"
+        self.search_bots = {}  # Созданные поисковые боты по названию
+        self.bot_worker = BotWorker(self)  # Ход компьютера в фоновом потоке
+        self.view_x = 0  # Левая верхняя видимая клетка поля
+        self.view_y = 0
+        self.drag_start = None  # Перетаскивание поля правой кнопкой: (позиция мыши, view_x, view_y)
+        self.piece_ids = None  # Номер фигуры в каждой клетке (0 - пусто) для границ фигур
+        self.view_surface = None  # Кэш видимой части поля: (ключ, поверхность)
+        self.saved_turns = 0  # Длина истории партии при последнем сохранении
+        self.shown_frame = None  # Состояние, показанное в прошлом кадре (None - обновить весь экран)
+        self.shown_ghost = None  # Область текущей фигуры в прошлом кадре
+        self.frame_times = FrameTimes()
+        self.show_perf = False  # Панель производительности (F3)
+        self.profiler = None  # cProfile.Profile, пока пишется профиль (F4)
+        self.profile_until = 0.0
+        self.profile_path = None  # Последний записанный профиль
+        self.menu_message = None  # Сообщение в меню (например, почему не загрузилась партия)
         self.player_colors = [
             (0, 255, 170),    # Зеленый
             (255, 100, 100),  # Красный
@@ -63,457 +129,273 @@ class Game:
         ]
 
     def start_game(self):
-        self.cell_size = min((HEIGHT - 100) // self.board_size, 16)  # Уменьшаем размер для вмещения
-        self.board = np.zeros((self.board_size, self.board_size), dtype=int)
-        
-        # Создаем нужное количество игроков
-        self.players = [Player(i) for i in range(self.num_players)]
-        self.current_player = 0
-        self.dice_result = (0, 0)
-        self.current_rect = None
+        self.prepare_session()
+        super().start_game()
+
+    def prepare_session(self):
+        """Вид поля, бот и состояние окна для новой или продолженной партии размера board_size"""
+        # Поле целиком, если помещается; большие поля показываются огрубленно, их можно приблизить
+        self.cell_size = min(VIEW_SIZE // self.board_size, 16)
+        if self.cell_size < 1:
+            self.cell_size = max([zoom for zoom in ZOOM_LEVELS if zoom <= VIEW_SIZE / self.board_size] or ZOOM_LEVELS[:1])
         self.offset_x = 0
         self.offset_y = 0
-        self.rotation = 0
-        self.placed_rects = {i: [] for i in range(self.num_players)}
-        self.valid_positions = set()
+        self.view_x = 0
+        self.view_y = 0
+        self.drag_start = None
+        self.piece_ids = np.zeros((self.board_size, self.board_size), dtype=np.int32)
         self.state = "playing"
-        self.first_move = {i: True for i in range(self.num_players)}
-        self.skip_turn_available = False
-        self.game_over = False
-        self.winner = None
-        self.player_scores = [0] * self.num_players
-        self.piece_queue = []
-        self.premature_endgame = False
-        self.blocked_cells = set()
-        self.frontier_lines = []
-        self.generate_piece_queue()
-        self.roll_dice()
-
-    def generate_piece_queue(self):
-        """Генерирует очередь из 3 следующих фигур"""
-        while len(self.piece_queue) < self.max_queue_size:
-            dice_result = (random.randint(1, 6), random.randint(1, 6))
-            self.piece_queue.append(dice_result)
-
-    def roll_dice(self):
-        # Берем первую фигуру из очереди
-        if self.piece_queue:
-            self.dice_result = self.piece_queue.pop(0)
+        self.view_surface = None
+        self.shown_frame = None
+        self.saved_turns = 0
+        self.bot_worker.cancel()
+        
+        # Выбор бота для PvC
+        if self.game_mode == "pvc" and self.selected_bot != "evaluate":
+            if self.selected_bot not in self.search_bots:
+                if self.selected_bot == "mcts":
+                    # Без пула: пересылка позиций в процессы дороже самих доигрываний,
+                    # и за то же время пул успевает меньше итераций
+                    bot = MCTSBot(time_limit=0.4)
+                else:
+                    bot = ExpectimaxBot(time_limit=0.4)
+                self.search_bots[self.selected_bot] = bot
+            self.bot_strategy = self.search_bots[self.selected_bot]
+            self.bot_strategy.reset()
         else:
-            self.dice_result = (random.randint(1, 6), random.randint(1, 6))
-            
-        self.create_current_rect()
-        self.update_valid_positions()
-        
-        # Добавляем новую фигуру в очередь
-        self.generate_piece_queue()
-        
-        # Если нет доступных ходов, предлагаем пропустить ход
-        if not self.valid_positions:
-            self.skip_turn_available = True
+            self.bot_strategy = "evaluate"
+        self.menu_message = None
+
+    def save_game(self):
+        """Сохраняет незаконченную партию вместе с режимом и выбранным ботом"""
+        if self.state != "playing" or self.game_over:
+            return
+        try:
+            save_snapshot(self, SAVE_PATH, mode=self.game_mode, bot=self.selected_bot, piece_ids=self.piece_ids)
+        except OSError as error:
+            print(f"Не удалось сохранить партию: {error}", file=sys.stderr)
+        self.saved_turns = len(self.history)
 
-    def create_current_rect(self):
-        w, h = self.dice_result
-        if self.rotation == 1:
-            w, h = h, w
-        self.current_rect = pygame.Rect(0, 0, w, h)
+    def autosave(self):
+        """Сохраняет партию каждые AUTOSAVE_TURNS ходов; законченную продолжать незачем"""
+        if self.state != "playing":
+            return
+        if self.game_over:
+            if os.path.exists(SAVE_PATH):
+                os.remove(SAVE_PATH)
+        elif len(self.history) - self.saved_turns >= AUTOSAVE_TURNS:
+            self.save_game()
+
+    def load_game(self, path=SAVE_PATH):
+        """Продолжает сохраненную партию; если ее не прочитать, остается в меню с сообщением"""
+        try:
+            snapshot = read_snapshot(path)
+            game_mode, selected_bot = str(snapshot["mode"]), str(snapshot["bot"])
+            # Сначала в отдельный движок: испорченный снимок не должен наполовину заменить партию окна
+            engine = Engine()
+            engine.metrics = self.metrics
+            restore_snapshot(engine, snapshot)
+            piece_ids = snapshot.get("piece_ids")
+            if piece_ids is not None and piece_ids.shape != engine.board.shape:
+                raise ValueError("номера фигур снимка не совпадают с доской")
+        except (OSError, ValueError, KeyError, IndexError, zipfile.BadZipFile) as error:
+            print(f"Не удалось продолжить партию: {error}", file=sys.stderr)
+            self.menu_message = "Сохранение не читается: файл поврежден или от старой версии"
+            return False
+        self.game_mode = game_mode
+        self.selected_bot = selected_bot
+        vars(self).update(vars(engine))  # Состояние партии целиком; бота и вид задает prepare_session
+        self.prepare_session()
+        self.selected_size = self.board_size
+        self.saved_turns = len(self.history)
+        if piece_ids is not None:
+            self.piece_ids = piece_ids
+        else:
+            # Номера фигур для их границ - по порядку ходов, как при игре
+            for number, (_, _, rect) in enumerate(self.history, 1):
+                if rect is not None:
+                    x, y, w, h = rect
+                    self.piece_ids[y:y + h, x:x + w] = number
+        return True
 
     def update_valid_positions(self):
-        self.valid_positions.clear()
-        
-        # Для первого хода - углы для каждого игрока
-        if self.first_move[self.current_player]:
-            corner_positions = {
-                0: (0, 0),                                    # Левый верхний
-                1: (self.board_size - self.current_rect.width, 
-                    self.board_size - self.current_rect.height),  # Правый нижний
-            }
-            
-            # Для 3-4 игроков добавляем еще углы
-            if self.num_players >= 3:
-                corner_positions[2] = (self.board_size - self.current_rect.width, 0)  # Правый верхний
-            if self.num_players >= 4:
-                corner_positions[3] = (0, self.board_size - self.current_rect.height)  # Левый нижний
-                
-            self.valid_positions = {corner_positions.get(self.current_player, (0, 0))}
+        started = time.perf_counter()
+        super().update_valid_positions()
+        self.frame_times.add("допустимые позиции", time.perf_counter() - started)
+
+    def start_profile(self):
+        """Начинает писать профиль на PROFILE_SECONDS секунд"""
+        if self.profiler is not None:
             return
+        self.profiler = cProfile.Profile()
+        self.profile_until = time.perf_counter() + PROFILE_SECONDS
+        self.profiler.enable()
 
-        for y in range(self.board_size - self.current_rect.height + 1):
-            for x in range(self.board_size - self.current_rect.width + 1):
-                if self.can_place(x, y):
-                    self.valid_positions.add((x, y))
+    def stop_profile(self):
+        """Записывает профиль в .prof рядом с игрой (смотреть: python -m pstats файл)"""
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), time.strftime("профиль_%Y%m%d_%H%M%S.prof"))
+        try:
+            self.profiler.dump_stats(path)
+            self.profile_path = path  # Имя файла показывает панель F3
+        except OSError as error:
+            print(f"Не удалось записать профиль: {error}", file=sys.stderr)
+        self.profiler = None
 
-    def can_place(self, x, y):
-        # Проверка выхода за границы
-        if x < 0 or y < 0 or x + self.current_rect.width > self.board_size or y + self.current_rect.height > self.board_size:
-            return False
-        
-        # Проверка пересечения с другими фигурами
-        for i in range(y, y + self.current_rect.height):
-            for j in range(x, x + self.current_rect.width):
-                if self.board[i][j] != 0:
-                    return False
-        
-        # Для первого хода каждого игрока разрешаем ставить без примыкания
-        if self.first_move[self.current_player]:
-            return True
-        
-        # Новая механика: как минимум одна сторона должна полностью перекрываться с уже стоящими фигурами
-        has_overlapping_side = False
-        
-        # Проверка левой границы - должна перекрываться полностью
-        if x > 0:
-            full_overlap = True
-            for i in range(y, y + self.current_rect.height):
-                if self.board[i][x-1] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        # Проверка правой границы - должна перекрываться полностью
-        if x + self.current_rect.width < self.board_size:
-            full_overlap = True
-            for i in range(y, y + self.current_rect.height):
-                if self.board[i][x + self.current_rect.width] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        # Проверка верхней границы - должна перекрываться полностью
-        if y > 0:
-            full_overlap = True
-            for j in range(x, x + self.current_rect.width):
-                if self.board[y-1][j] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        # Проверка нижней границы - должна перекрываться полностью
-        if y + self.current_rect.height < self.board_size:
-            full_overlap = True
-            for j in range(x, x + self.current_rect.width):
-                if self.board[y + self.current_rect.height][j] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        return has_overlapping_side
+    def check_profile(self):
+        if self.profiler is not None and time.perf_counter() >= self.profile_until:
+            self.stop_profile()
+
+    def play_bot_move(self, move):
+        moved = super().play_bot_move(move)
+        if moved:
+            # Курсор остается на фигуре, которую поставил компьютер
+            self.offset_x, self.offset_y = self.last_move[:2]
+            self.follow_cursor()
+        return moved
 
     def place_rect(self, x, y):
-        if (x, y) not in self.valid_positions:
-            return False
-        
-        # Занимаем клетки
-        for i in range(y, y + self.current_rect.height):
-            for j in range(x, x + self.current_rect.width):
-                self.board[i][j] = self.current_player + 1
-        
-        # Сохраняем прямоугольник
-        rect_data = (x, y, self.current_rect.width, self.current_rect.height)
-        self.placed_rects[self.current_player].append(rect_data)
-        
-        # Сбрасываем флаг первого хода после размещения
-        if self.first_move[self.current_player]:
-            self.first_move[self.current_player] = False
-        
-        # Переход хода к следующему игроку
-        self.current_player = (self.current_player + 1) % self.num_players
-        self.rotation = 0
-        self.skip_turn_available = False
-        self.roll_dice()
-        
-        return True
+        placed = super().place_rect(x, y)
+        if placed:
+            x, y, w, h = self.last_move
+            self.piece_ids[y:y + h, x:x + w] = len(self.history)
+        return placed
 
-    def skip_turn(self):
-        """Пропустить ход"""
-        self.current_player = (self.current_player + 1) % self.num_players
-        self.rotation = 0
-        self.skip_turn_available = False
-        self.roll_dice()
-        
-        # Проверяем, может ли следующий игрок сделать ход
-        if not self.valid_positions:
-            self.skip_turn_available = True
-
-    def check_premature_endgame(self):
-        """Проверяет, есть ли преждевременный эндгейм"""
-        # Для каждого игрока проверяем, соединяет ли он две противоположные стороны
-        # Пока работает только для 2 игроков
-        if self.num_players == 2:
-            for player_id in [1, 2]:
-                if self.connects_opposite_sides(player_id):
-                    return True
-        return False
-
-    def connects_opposite_sides(self, player_id):
-        """Проверяет, соединяет ли игрок две противоположные стороны поля"""
-        # Создаем карту занятых клеток для игрока
-        player_map = np.zeros((self.board_size, self.board_size), dtype=bool)
-        for i in range(self.board_size):
-            for j in range(self.board_size):
-                if self.board[i][j] == player_id:
-                    player_map[i][j] = True
-        
-        # Проверяем соединение противоположных сторон
-        # Верх-низ
-        if self.connects_sides(player_map, 'top', 'bottom'):
-            self.find_frontier_lines(player_id, 'horizontal')
-            return True
-        
-        # Лево-право
-        if self.connects_sides(player_map, 'left', 'right'):
-            self.find_frontier_lines(player_id, 'vertical')
-            return True
-            
-        return False
+    def visible_cells(self):
+        """Сколько клеток поля видно по каждой оси"""
+        return min(self.board_size, int(VIEW_SIZE / self.cell_size))
 
-    def connects_sides(self, player_map, side1, side2):
-        """Проверяет, соединены ли две стороны через фигуры игрока"""
-        visited = np.zeros((self.board_size, self.board_size), dtype=bool)
-        queue = deque()
-        
-        # Добавляем начальные точки
-        if side1 == 'top':
-            for j in range(self.board_size):
-                if player_map[0][j] and not visited[0][j]:
-                    queue.append((0, j))
-                    visited[0][j] = True
-        elif side1 == 'left':
-            for i in range(self.board_size):
-                if player_map[i][0] and not visited[i][0]:
-                    queue.append((i, 0))
-                    visited[i][0] = True
-        
-        # BFS для поиска пути
-        while queue:
-            x, y = queue.popleft()
-            
-            # Проверяем, достигли ли мы целевой стороны
-            if side2 == 'bottom' and x == self.board_size - 1:
-                return True
-            elif side2 == 'right' and y == self.board_size - 1:
-                return True
-            
-            # Проверяем соседей
-            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                nx, ny = x + dx, y + dy
-                if (0 <= nx < self.board_size and 0 <= ny < self.board_size and 
-                    player_map[nx][ny] and not visited[nx][ny]):
-                    visited[nx][ny] = True
-                    queue.append((nx, ny))
-        
-        return False
+    def view_width(self):
+        """Сторона видимой части поля на экране, пикселей"""
+        return int(self.visible_cells() * self.cell_size)
 
-    def find_frontier_lines(self, player_id, orientation):
-        """Находит линии передового контура"""
-        self.frontier_lines = []
-        
-        if orientation == 'horizontal':
-            # Ищем горизонтальные линии контура
-            for i in range(self.board_size):
-                for j in range(self.board_size):
-                    if self.board[i][j] == player_id:
-                        # Проверяем верхнюю границу
-                        if i == 0 or self.board[i-1][j] != player_id:
-                            self.frontier_lines.append(((j, i), (j+1, i)))
-                        # Проверяем нижнюю границу
-                        if i == self.board_size - 1 or self.board[i+1][j] != player_id:
-                            self.frontier_lines.append(((j, i+1), (j+1, i+1)))
-                        # Проверяем левую границу
-                        if j == 0 or self.board[i][j-1] != player_id:
-                            self.frontier_lines.append(((j, i), (j, i+1)))
-                        # Проверяем правую границу
-                        if j == self.board_size - 1 or self.board[i][j+1] != player_id:
-                            self.frontier_lines.append(((j+1, i), (j+1, i+1)))
-        
-        elif orientation == 'vertical':
-            # Ищем вертикальные линии контура
-            for i in range(self.board_size):
-                for j in range(self.board_size):
-                    if self.board[i][j] == player_id:
-                        # Проверяем границы аналогично
-                        if i == 0 or self.board[i-1][j] != player_id:
-                            self.frontier_lines.append(((j, i), (j+1, i)))
-                        if i == self.board_size - 1 or self.board[i+1][j] != player_id:
-                            self.frontier_lines.append(((j, i+1), (j+1, i+1)))
-                        if j == 0 or self.board[i][j-1] != player_id:
-                            self.frontier_lines.append(((j, i), (j, i+1)))
-                        if j == self.board_size - 1 or self.board[i][j+1] != player_id:
-                            self.frontier_lines.append(((j+1, i), (j+1, i+1)))
-
-    def find_blocked_cells(self, blocking_player):
-        """Находит клетки, доступ к которым заблокирован"""
-        self.blocked_cells = set()
-        opponent_id = 3 - blocking_player  # 1->2, 2->1
-        
-        # Создаем карту доступных клеток для противника с помощью BFS
-        accessible = np.zeros((self.board_size, self.board_size), dtype=bool)
-        visited = np.zeros((self.board_size, self.board_size), dtype=bool)
-        queue = deque()
-        
-        # Начальные точки - края поля, не занятые блокирующим игроком
-        # Верхний край
-        for j in range(self.board_size):
-            if self.board[0][j] != blocking_player:
-                queue.append((0, j))
-                if self.board[0][j] == 0:
-                    accessible[0][j] = True
-        
-        # Левый край
-        for i in range(self.board_size):
-            if self.board[i][0] != blocking_player:
-                queue.append((i, 0))
-                if self.board[i][0] == 0:
-                    accessible[i][0] = True
-        
-        # BFS для поиска доступных клеток
-        while queue:
-            x, y = queue.popleft()
-            if visited[x][y]:
-                continue
-            visited[x][y] = True
-            
-            # Проверяем соседей
-            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                nx, ny = x + dx, y + dy
-                if (0 <= nx < self.board_size and 0 <= ny < self.board_size and 
-                    not visited[nx][ny] and self.board[nx][ny] != blocking_player):
-                    if self.board[nx][ny] == 0:
-                        accessible[nx][ny] = True
-                    queue.append((nx, ny))
-        
-        # Все незанятые клетки, которые не доступны, считаются заблокированными
-        for i in range(self.board_size):
-            for j in range(self.board_size):
-                if self.board[i][j] == 0 and not accessible[i][j]:
-                    self.blocked_cells.add((i, j))
-
-    def handle_premature_endgame(self):
-        """Обрабатывает преждевременный эндгейм"""
-        self.premature_endgame = True
-        
-        # Определяем, какой игрок вызвал эндгейм
-        blocking_player = self.current_player + 1
-        
-        # Находим заблокированные клетки
-        self.find_blocked_cells(blocking_player)
-        
-        # Присваиваем заблокированные клетки блокирующему игроку
-        for i, j in self.blocked_cells:
-            self.board[i][j] = blocking_player
-        
-        # Завершаем игру
-        self.end_game()
+    def cell_to_screen(self, x, y):
+        return 50 + (x - self.view_x) * self.cell_size, 50 + (y - self.view_y) * self.cell_size
 
-    def end_game(self):
-        """Завершение игры и подсчет очков"""
-        self.game_over = True
-        
-        # Подсчет очков: занятые клетки
-        for i in range(self.num_players):
-            self.player_scores[i] = np.sum(self.board == i + 1)
-        
-        # Определение победителя
-        max_score = max(self.player_scores)
-        winners = [i for i, score in enumerate(self.player_scores) if score == max_score]
-        
-        if len(winners) == 1:
-            self.winner = winners[0]
+    def screen_to_cell(self, pos):
+        """Клетка поля под точкой экрана или None, если точка вне поля"""
+        rel_x = pos[0] - 50
+        rel_y = pos[1] - 50
+        if not (0 <= rel_x < self.view_width() and 0 <= rel_y < self.view_width()):
+            return None
+        return self.view_x + int(rel_x / self.cell_size), self.view_y + int(rel_y / self.cell_size)
+
+    def scroll_to(self, view_x, view_y):
+        """Сдвигает видимую часть, не выходя за края поля"""
+        limit = self.board_size - self.visible_cells()
+        self.view_x = max(0, min(int(view_x), limit))
+        self.view_y = max(0, min(int(view_y), limit))
+
+    def zoom(self, step, pos=None):
+        """Следующий масштаб крупнее (step > 0) или мельче; клетка под pos остается на месте"""
+        if step > 0:
+            larger = [zoom for zoom in ZOOM_LEVELS if zoom > self.cell_size]
+            if not larger:
+                return
+            cell_size = larger[0]
         else:
-            self.winner = None  # Ничья
+            smaller = [zoom for zoom in ZOOM_LEVELS if zoom < self.cell_size]
+            if not smaller or self.visible_cells() == self.board_size:
+                return
+            cell_size = smaller[-1]
+        if pos is None or self.screen_to_cell(pos) is None:
+            pos = (50 + self.view_width() // 2, 50 + self.view_width() // 2)
+        cell_x, cell_y = self.screen_to_cell(pos)
+        self.cell_size = cell_size
+        self.scroll_to(cell_x - (pos[0] - 50) / cell_size, cell_y - (pos[1] - 50) / cell_size)
 
-    def bot_move(self):
-        if not self.valid_positions:
-            # Если нет валидных позиций, пропускаем ход
-            self.skip_turn()
-            return False
-        
-        # Улучшенная стратегия бота
-        best_pos = None
-        best_score = -1
-        
-        # Оцениваем каждую возможную позицию
-        for pos in self.valid_positions:
-            x, y = pos
-            score = self.evaluate_position(x, y)
-            if score > best_score:
-                best_score = score
-                best_pos = pos
-        
-        if best_pos:
-            x, y = best_pos
-            self.offset_x = x
-            self.offset_y = y
-            self.place_rect(x, y)
-            return True
+    def handle_view_key(self, key):
+        """Масштаб (+/-) и сдвиг поля (WASD); возвращает, была ли это такая клавиша"""
+        if key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+            self.zoom(1)
+        elif key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+            self.zoom(-1)
+        elif key in (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d):
+            # Сдвиг на четверть видимой части
+            step = max(1, self.visible_cells() // 4)
+            dx = {pygame.K_a: -step, pygame.K_d: step}.get(key, 0)
+            dy = {pygame.K_w: -step, pygame.K_s: step}.get(key, 0)
+            self.scroll_to(self.view_x + dx, self.view_y + dy)
         else:
-            # Если не нашли хорошую позицию, ставим в случайное место
-            x, y = random.choice(list(self.valid_positions))
-            self.offset_x = x
-            self.offset_y = y
-            self.place_rect(x, y)
-            return True
-
-    def evaluate_position(self, x, y):
-        """Оценивает качество позиции для бота"""
-        score = 0
-        
-        # Бонус за близость к противнику
-        distance_to_opponent = self.get_distance_to_opponent(x, y)
-        score += max(0, 100 - distance_to_opponent * 2)
-        
-        # Бонус за контроль центра
-        center_x, center_y = self.board_size // 2, self.board_size // 2
-        distance_to_center = abs(x - center_x) + abs(y - center_y)
-        score += max(0, 50 - distance_to_center)
-        
-        # Бонус за размер фигуры (чем больше, тем лучше)
-        area = self.current_rect.width * self.current_rect.height
-        score += area * 3
-        
-        # Штраф за слишком близкое расположение к краям
-        if x < 2 or y < 2 or x + self.current_rect.width > self.board_size - 2 or y + self.current_rect.height > self.board_size - 2:
-            score -= 20
-        
-        return score
-
-    def get_distance_to_opponent(self, x, y):
-        """Вычисляет минимальное расстояние до фигур противника"""
-        # Для многопользовательской игры нужно учитывать всех противников
-        # Пока используем логику для 2 игроков
-        opponent_id = 2 if self.current_player == 0 else 1
-        min_dist = float('inf')
-        
-        # Проверяем расстояние до всех клеток противника
-        for i in range(self.board_size):
-            for j in range(self.board_size):
-                if self.board[i][j] == opponent_id:
-                    dist = abs(x - j) + abs(y - i)  # Манхэттенское расстояние
-                    min_dist = min(min_dist, dist)
-        
-        return min_dist if min_dist != float('inf') else 0
+            return False
+        return True
+
+    def follow_cursor(self):
+        """Сдвигает видимую часть, чтобы текущая фигура была на экране"""
+        visible = self.visible_cells()
+        view_x = min(self.view_x, self.offset_x)
+        view_x = max(view_x, self.offset_x + self.current_rect.width - visible)
+        view_y = min(self.view_y, self.offset_y)
+        view_y = max(view_y, self.offset_y + self.current_rect.height - visible)
+        self.scroll_to(view_x, view_y)
 
     def draw(self, screen):
+        """Рисует кадр и возвращает области экрана, изменившиеся с прошлого кадра"""
         screen.fill(BACKGROUND)
         
         if self.state == "menu":
             self.draw_menu(screen)
-        elif self.state == "playing":
-            self.draw_board(screen)
-            self.draw_ui(screen)
+            if self.show_perf:
+                self.draw_perf(screen)
+            self.shown_frame = None
+            return [screen.get_rect()]
+
+        self.draw_board(screen)
+        self.draw_ui(screen)
+
+        # Пока не было ходов, бросков и поворотов, меняется только текущая фигура под курсором
+        frame = (len(self.history), self.current_player, self.dice_result, self.rotation,
+                 self.skip_turn_available, self.game_over, self.view_x, self.view_y, self.cell_size)
+        ghost = pygame.Rect(
+            self.cell_to_screen(self.offset_x, self.offset_y),
+            (self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size)
+        ).inflate(10, 10)  # С запасом на рамку и точку в центре
+        if frame != self.shown_frame:
+            dirty = [screen.get_rect()]
+        elif ghost != self.shown_ghost:
+            dirty = [self.shown_ghost, ghost]
+        else:
+            dirty = []
+        if self.show_perf:
+            dirty.append(self.draw_perf(screen))
+        self.shown_frame = frame
+        self.shown_ghost = ghost
+        return dirty
+
+    def draw_perf(self, screen):
+        """Панель производительности поверх поля; возвращает ее область"""
+        averages = self.frame_times.averages()
+        lines = [f"Кадр: {sum(averages.values()):.1f} мс, {self.frame_times.fps():.0f} кадров/с"]
+        lines += [f"  {name}: {ms:.2f} мс" for name, ms in averages.items()]
+        lines.append(f"Допустимых позиций: {len(self.valid_positions)}")
+        think_time = f"{self.bot_worker.think_time * 1000:.0f} мс" if self.bot_worker.think_time else "-"
+        lines.append(f"Выбор хода компьютером: {think_time}")
+        if self.profiler is not None:
+            lines.append(f"Пишется профиль: еще {max(0.0, self.profile_until - time.perf_counter()):.0f} с")
+        else:
+            lines.append("F4 - записать профиль")
+            if self.profile_path is not None:
+                lines.append(os.path.basename(self.profile_path))
+
+        texts = [small_font.render(line, True, TEXT_COLOR) for line in lines]
+        rect = pygame.Rect(55, 55, max(text.get_width() for text in texts) + 20, len(texts) * 20 + 10)
+        panel = pygame.Surface(rect.size, pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 190))
+        screen.blit(panel, rect)
+        for i, text in enumerate(texts):
+            screen.blit(text, (rect.x + 10, rect.y + 5 + i * 20))
+        return rect
 
     def draw_menu(self, screen):
         title = title_font.render("ПРЯМОУГОЛЬНЫЕ БИТВЫ", True, TEXT_COLOR)
         screen.blit(title, (WIDTH//2 - title.get_width()//2, 50))
         
-        # Кнопки выбора размера (3 кнопки)
-        sizes = [("Малый (50x50)", 50), ("Средний (100x100)", 100), ("Большой (150x150)", 150)]
+        # Кнопки выбора размера (2 x 2)
+        sizes = [("Малый (50x50)", 50), ("Средний (100x100)", 100), ("Большой (150x150)", 150), ("Огромный (1000x1000)", 1000)]
         for i, (text, size) in enumerate(sizes):
-            rect = pygame.Rect(WIDTH//2 - 150, 130 + i*70, 300, 60)
+            rect = pygame.Rect(WIDTH//2 - 310 + (i % 2)*320, 130 + (i // 2)*70, 300, 60)
             color = SELECTED_COLOR if size == self.selected_size else UI_BORDER
             pygame.draw.rect(screen, UI_BG, rect, border_radius=12)
             pygame.draw.rect(screen, color, rect, 2, border_radius=12)
@@ -546,6 +428,20 @@ class Game:
             players_label = font.render("Количество игроков:", True, TEXT_COLOR)
             screen.blit(players_label, (WIDTH//2 - players_label.get_width()//2, 490))
         
+        # Кнопки выбора бота (только для PvC) - в одну строку
+        if self.selected_mode == "pvc":
+            bots = [("Оценка", "evaluate"), ("MCTS", "mcts"), ("Expectimax", "expectimax")]
+            for i, (text, bot) in enumerate(bots):
+                rect = pygame.Rect(WIDTH//2 - 230 + i*160, 520, 140, 60)
+                color = SELECTED_COLOR if bot == self.selected_bot else UI_BORDER
+                pygame.draw.rect(screen, UI_BG, rect, border_radius=12)
+                pygame.draw.rect(screen, color, rect, 2, border_radius=12)
+                text_surf = font.render(text, True, TEXT_COLOR)
+                screen.blit(text_surf, (rect.centerx - text_surf.get_width()//2, rect.centery - text_surf.get_height()//2))
+            
+            bot_label = font.render("Компьютер:", True, TEXT_COLOR)
+            screen.blit(bot_label, (WIDTH//2 - bot_label.get_width()//2, 490))
+        
         # Кнопка старта
         if self.selected_size and self.selected_mode:
             start_rect = pygame.Rect(WIDTH//2 - 100, 620, 200, 60)
@@ -553,85 +449,112 @@ class Game:
             pygame.draw.rect(screen, (0, 200, 0), start_rect, 2, border_radius=12)
             start_text = font.render("Начать игру", True, TEXT_COLOR)
             screen.blit(start_text, (start_rect.centerx - start_text.get_width()//2, start_rect.centery - start_text.get_height()//2))
+        
+        # Кнопка продолжения сохраненной партии
+        if os.path.exists(SAVE_PATH):
+            continue_rect = pygame.Rect(WIDTH//2 - 100, 700, 200, 60)
+            pygame.draw.rect(screen, UI_BG, continue_rect, border_radius=12)
+            pygame.draw.rect(screen, (0, 200, 0), continue_rect, 2, border_radius=12)
+            continue_text = font.render("Продолжить", True, TEXT_COLOR)
+            screen.blit(continue_text, (continue_rect.centerx - continue_text.get_width()//2, continue_rect.centery - continue_text.get_height()//2))
+        
+        if self.menu_message:
+            message_text = font.render(self.menu_message, True, WARNING_COLOR)
+            screen.blit(message_text, (WIDTH//2 - message_text.get_width()//2, 765))
+
+    def view_layer(self):
+        """Видимая часть поля с подсветкой допустимых позиций; пересобирается при ходе, повороте и сдвиге.
+
+        Рисуется только видимое окно доски, поэтому время не зависит от размера поля.
+        """
+        key = (len(self.history), self.current_player, self.dice_result, self.rotation,
+               self.game_over, self.view_x, self.view_y, self.cell_size)
+        if self.view_surface is not None and self.view_surface[0] == key:
+            return self.view_surface[1]
+
+        visible = self.visible_cells()
+        window = (slice(self.view_y, self.view_y + visible), slice(self.view_x, self.view_x + visible))
+        if self.cell_size < 1:
+            # Огрубление: каждая step-я клетка по обеим осям, по пикселю на клетку
+            step = round(1 / self.cell_size)
+            window = tuple(slice(part.start, part.stop, step) for part in window)
+        scale = max(1, int(self.cell_size))
+
+        # Цвета: пусто, игроки, сетка, граница фигуры, и те же цвета под подсветкой
+        palette = np.array([BACKGROUND] + self.player_colors + [GRID_COLOR, (0, 0, 0)], dtype=np.uint16)
+        grid_index, border_index = len(palette) - 2, len(palette) - 1
+        alpha = 90
+        lit = (palette * (255 - alpha) + np.array(HIGHLIGHT[:3], dtype=np.uint16) * alpha) // 255
+        palette = np.concatenate([palette, lit]).tolist()
+
+        # Номер цвета для каждого пикселя клетки: [строка, столбец, y в клетке, x в клетке]
+        owners = self.board[window]
+        rows, cols = owners.shape
+        cells = np.empty((rows, cols, scale, scale), dtype=np.uint8)
+        cells[...] = owners[:, :, None, None]
+        if scale >= DETAIL_ZOOM:
+            # Сетка на пустых клетках
+            empty = owners == 0
+            cells[empty, 0, :] = grid_index
+            cells[empty, :, 0] = grid_index
+
+            # Границы фигур - там, где у соседней клетки другой номер фигуры
+            ids = np.pad(self.piece_ids[window], 1, constant_values=-1)
+            inner = ids[1:-1, 1:-1]
+            filled = inner > 0
+            cells[filled & (inner != ids[1:-1, :-2]), :, 0] = border_index
+            cells[filled & (inner != ids[1:-1, 2:]), :, -1] = border_index
+            cells[filled & (inner != ids[:-2, 1:-1]), 0, :] = border_index
+            cells[filled & (inner != ids[2:, 1:-1]), -1, :] = border_index
+
+        # Полупрозрачная подсветка левых верхних углов, куда можно поставить фигуру
+        if not self.game_over:
+            valid = self.valid_mask[window]
+            cells[:valid.shape[0], :valid.shape[1]][valid] += len(palette) // 2
+
+        # surfarray индексирует [x, y], поэтому пиксели собираются по столбцам;
+        # цвета сразу в формате поверхности, чтобы обойтись одним take
+        surface = pygame.Surface((cols * scale, rows * scale), 0, 32)
+        colors = np.array([surface.map_rgb(color) for color in palette], dtype=np.uint32)
+        pixels = np.take(colors, cells.transpose(1, 3, 0, 2).reshape(cols * scale, rows * scale))
+        pygame.surfarray.blit_array(surface, pixels)
+        self.view_surface = (key, surface)
+        return surface
 
     def draw_board(self, screen):
-        board_width = self.board_size * self.cell_size
-        board_rect = pygame.Rect(50, 50, board_width, board_width)
+        view_width = self.view_width()
         
-        # Рисуем сетку
-        for i in range(self.board_size + 1):
-            pygame.draw.line(
-                screen, GRID_COLOR,
-                (50, 50 + i * self.cell_size),
-                (50 + board_width, 50 + i * self.cell_size)
-            )
-            pygame.draw.line(
-                screen, GRID_COLOR,
-                (50 + i * self.cell_size, 50),
-                (50 + i * self.cell_size, 50 + board_width)
-            )
-        
-        # Рисуем заблокированные клетки (если есть)
-        if self.premature_endgame:
-            for i, j in self.blocked_cells:
-                pygame.draw.rect(
-                    screen, (*self.player_colors[self.current_player], 100),
-                    (50 + j * self.cell_size, 50 + i * self.cell_size, self.cell_size, self.cell_size)
-                )
-        
-        # Рисуем размещенные фигуры
-        for player_idx in range(self.num_players): # Используем range(self.num_players)
-            for rect_data in self.placed_rects[player_idx]:
-                x, y, w, h = rect_data
-                pygame.draw.rect(
-                    screen, self.player_colors[player_idx], # Используем self.player_colors
-                    (50 + x * self.cell_size, 50 + y * self.cell_size, w * self.cell_size, h * self.cell_size)
-                )
-                # Границы фигур
-                pygame.draw.rect(
-                    screen, (0, 0, 0),
-                    (50 + x * self.cell_size, 50 + y * self.cell_size, w * self.cell_size, h * self.cell_size),
-                    1
-                )
+        # Видимая часть поля - одним готовым слоем, остальное обрезается по ее краям
+        screen.blit(self.view_layer(), (50, 50))
+        screen.set_clip(pygame.Rect(50, 50, view_width, view_width))
         
         # Рисуем текущий прямоугольник
         if self.current_rect and not self.game_over:
             x, y = self.offset_x, self.offset_y
             # Используем полупрозрачный цвет для текущего игрока
             color = self.player_colors[self.current_player] # Используем self.player_colors
-            rect_surf = pygame.Surface((self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size), pygame.SRCALPHA)
+            rect_width = max(1, int(self.current_rect.width * self.cell_size))
+            rect_height = max(1, int(self.current_rect.height * self.cell_size))
+            rect_surf = pygame.Surface((rect_width, rect_height), pygame.SRCALPHA)
             rect_surf.fill((*color, 100))  # Полупрозрачный цвет
-            pygame.draw.rect(rect_surf, HIGHLIGHT[:3], (0, 0, self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size), 2)
-            screen.blit(rect_surf, (50 + x * self.cell_size, 50 + y * self.cell_size))
+            # Рамка показывает, можно ли поставить фигуру здесь
+            outline = HIGHLIGHT[:3] if self.can_place(x, y) else WARNING_COLOR
+            pygame.draw.rect(rect_surf, outline, (0, 0, rect_width, rect_height), 2)
+            screen.blit(rect_surf, self.cell_to_screen(x, y))
             
             # Центр фигуры
-            center_x = 50 + (x + self.current_rect.width/2) * self.cell_size
-            center_y = 50 + (y + self.current_rect.height/2) * self.cell_size
+            center_x, center_y = self.cell_to_screen(x + self.current_rect.width/2, y + self.current_rect.height/2)
             pygame.draw.circle(screen, (255, 255, 255), (int(center_x), int(center_y)), 4)
         
-        # Подсветка валидных позиций
-        if not self.game_over:
-            for pos in self.valid_positions:
-                x, y = pos
-                pygame.draw.rect(
-                    screen, HIGHLIGHT,
-                    (50 + x * self.cell_size, 50 + y * self.cell_size, 
-                     self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size),
-                    2
-                )
-        
         # Рисуем передовой контур (если есть)
         if self.premature_endgame and self.frontier_lines:
             for start, end in self.frontier_lines:
-                start_x = 50 + start[0] * self.cell_size
-                start_y = 50 + start[1] * self.cell_size
-                end_x = 50 + end[0] * self.cell_size
-                end_y = 50 + end[1] * self.cell_size
-                pygame.draw.line(screen, WIN_COLOR, (start_x, start_y), (end_x, end_y), 3)
+                pygame.draw.line(screen, WIN_COLOR, self.cell_to_screen(*start), self.cell_to_screen(*end), 3)
+        screen.set_clip(None)
         
         # Экран окончания игры
         if self.game_over:
-            overlay = pygame.Surface((board_width, board_width), pygame.SRCALPHA)
+            overlay = pygame.Surface((view_width, view_width), pygame.SRCALPHA)
             overlay.fill((0, 0, 0, 180))
             screen.blit(overlay, (50, 50))
             
@@ -657,7 +580,7 @@ class Game:
             screen.blit(restart_text, (WIDTH//2 - restart_text.get_width()//2, score_y + 20))
 
     def draw_ui(self, screen):
-        board_width = self.board_size * self.cell_size
+        board_width = self.view_width()
         
         # Панель информации (уменьшена высота)
         info_rect = pygame.Rect(60 + board_width, 50, WIDTH - board_width - 70, 350)
@@ -666,8 +589,7 @@ class Game:
         
         # Информация о игроках
         for i in range(self.num_players):
-            player_score = np.sum(self.board == i + 1)
-            player_text = font.render(f"Игрок {i + 1}: {player_score} клеток", True, self.player_colors[i])
+            player_text = font.render(f"Игрок {i + 1}: {self.cell_counts[i]} клеток", True, self.player_colors[i])
             screen.blit(player_text, (info_rect.x + 20, info_rect.y + 20 + i * 40))
         
         # Текущий игрок
@@ -726,32 +648,70 @@ class Game:
             # Подпись с размером
             size_text = font.render(f"{w}×{h}", True, TEXT_COLOR)
             screen.blit(size_text, (preview_x, preview_y + h * 8 + 5))
-
-class Player:
-    def __init__(self, player_id):
-        self.id = player_id
-        self.score = 0
+        
+        # Подсказка по управлению полем
+        for i, line in enumerate(("+/- или Ctrl+колесо - масштаб", "WASD или правая кнопка - сдвиг",
+                                      "F3 - производительность, F4 - профиль")):
+            hint_text = font.render(line, True, TEXT_COLOR)
+            screen.blit(hint_text, (60 + board_width, 620 + i * 30))
 
 def main():
+    init_display()
     game = Game()
+    if METRICS_PATH:
+        game.metrics = Metrics(METRICS_PATH)
     clock = pygame.time.Clock()
+    redraw = True  # Кадр мог измениться: были события или ход компьютера
     
     while True:
+        events = pygame.event.get()
+        if not events and not redraw:
+            # Ничего не происходит - спим до события, а пока думает компьютер, просыпаемся проверить его ход
+            waiting = game.bot_worker.pending or game.profiler is not None
+            event = pygame.event.wait(BOT_POLL_MS) if waiting else pygame.event.wait()
+            if event.type != pygame.NOEVENT:
+                events = [event]
+        redraw = redraw or bool(events)
+        game.frame_times.start_frame()
         mouse_pos = pygame.mouse.get_pos()
         
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
+                game.bot_worker.cancel()
+                game.stop_profile()
+                game.save_game()
+                if game.metrics is not None:
+                    game.metrics.flush()
+                if "mcts" in game.search_bots:
+                    game.search_bots["mcts"].close()
                 pygame.quit()
                 sys.exit()
             
+            # Окно было перекрыто - выводим кадр целиком
+            if event.type == pygame.WINDOWEXPOSED:
+                game.shown_frame = None
+            
             if event.type == pygame.KEYDOWN:
-                if game.state == "playing":
-                    if game.game_over:
+                if event.key == pygame.K_F3:
+                    game.show_perf = not game.show_perf
+                    game.shown_frame = None  # Убрать панель - значит перерисовать под ней
+                elif event.key == pygame.K_F4:
+                    game.start_profile()
+                elif game.state == "playing":
+                    if game.handle_view_key(event.key):
+                        pass  # Масштаб и сдвиг доступны всегда, в том числе после конца игры
+                    elif game.game_over:
                         if event.key == pygame.K_ESCAPE:
                             game.state = "menu"
                     else:
                         # Управление в игре
-                        if event.key == pygame.K_UP and game.offset_y > 0:
+                        if event.key == pygame.K_ESCAPE:
+                            game.bot_worker.cancel()
+                            game.save_game()
+                            game.state = "menu"
+                        elif game.bot_worker.pending:
+                            pass  # Пока думает компьютер, фигура и кубики его
+                        elif event.key == pygame.K_UP and game.offset_y > 0:
                             game.offset_y -= 1
                         elif event.key == pygame.K_DOWN and game.offset_y < game.board_size - game.current_rect.height:
                             game.offset_y += 1
@@ -760,28 +720,25 @@ def main():
                         elif event.key == pygame.K_RIGHT and game.offset_x < game.board_size - game.current_rect.width:
                             game.offset_x += 1
                         elif event.key == pygame.K_r:
-                            game.rotation = 1 - game.rotation
-                            game.create_current_rect()
-                            game.update_valid_positions()
+                            game.rotate()
                         elif event.key == pygame.K_SPACE:
                             if game.skip_turn_available:
                                 game.skip_turn()
                             else:
                                 game.roll_dice()
                         elif event.key == pygame.K_RETURN:
-                            if game.place_rect(game.offset_x, game.offset_y):
-                                # Ход компьютера в PvC режиме
-                                if game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
-                                    pygame.time.set_timer(pygame.USEREVENT, 500)
-                        elif event.key == pygame.K_ESCAPE:
-                            game.state = "menu"
+                            game.place_rect(game.offset_x, game.offset_y)
+                        
+                        # Фигура не уходит за край видимой части поля
+                        if event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_r):
+                            game.follow_cursor()
             
             # Обработка мыши в меню
             if event.type == pygame.MOUSEBUTTONDOWN and game.state == "menu":
                 # Обработка выбора размера
-                sizes = [("Малый (50x50)", 50), ("Средний (100x100)", 100), ("Большой (150x150)", 150)]
+                sizes = [("Малый (50x50)", 50), ("Средний (100x100)", 100), ("Большой (150x150)", 150), ("Огромный (1000x1000)", 1000)]
                 for i, (text, size) in enumerate(sizes):
-                    rect = pygame.Rect(WIDTH//2 - 150, 130 + i*70, 300, 60) # Исправлены координаты
+                    rect = pygame.Rect(WIDTH//2 - 310 + (i % 2)*320, 130 + (i // 2)*70, 300, 60)
                     if rect.collidepoint(event.pos):
                         game.selected_size = size
                 
@@ -800,6 +757,14 @@ def main():
                         if rect.collidepoint(event.pos):
                             game.num_players = count
                 
+                # Обработка выбора бота (только для PvC)
+                if game.selected_mode == "pvc":
+                    bots = [("Оценка", "evaluate"), ("MCTS", "mcts"), ("Expectimax", "expectimax")]
+                    for i, (text, bot) in enumerate(bots):
+                        rect = pygame.Rect(WIDTH//2 - 230 + i*160, 520, 140, 60)
+                        if rect.collidepoint(event.pos):
+                            game.selected_bot = bot
+                
                 # Кнопка старта
                 if game.selected_size and game.selected_mode:
                     start_rect = pygame.Rect(WIDTH//2 - 100, 620, 200, 60) # Исправлены координаты
@@ -807,82 +772,82 @@ def main():
                         game.board_size = game.selected_size
                         game.game_mode = game.selected_mode
                         game.start_game()
+                
+                # Кнопка продолжения
+                continue_rect = pygame.Rect(WIDTH//2 - 100, 700, 200, 60)
+                if continue_rect.collidepoint(event.pos) and os.path.exists(SAVE_PATH):
+                    if game.load_game():
+                        continue  # Щелчок не должен попасть в поле продолженной партии
+            
+            # Масштаб колесом с Ctrl и сдвиг поля правой кнопкой
+            if event.type == pygame.MOUSEBUTTONDOWN and game.state == "playing":
+                if event.button in (4, 5) and pygame.key.get_mods() & pygame.KMOD_CTRL:
+                    game.zoom(1 if event.button == 4 else -1, event.pos)
+                    continue
+                if event.button == 3:
+                    game.drag_start = (event.pos, game.view_x, game.view_y)
+            if event.type == pygame.MOUSEBUTTONUP and event.button == 3:
+                game.drag_start = None
+            if event.type == pygame.MOUSEMOTION and game.state == "playing" and game.drag_start is not None:
+                (start_x, start_y), view_x, view_y = game.drag_start
+                game.scroll_to(view_x - (event.pos[0] - start_x) / game.cell_size,
+                               view_y - (event.pos[1] - start_y) / game.cell_size)
+                continue
             
             # Обработка мыши в игре
-            if event.type == pygame.MOUSEBUTTONDOWN and game.state == "playing" and not game.game_over:
+            if (event.type == pygame.MOUSEBUTTONDOWN and game.state == "playing" and not game.game_over
+                    and not game.bot_worker.pending):
                 if event.button == 1:  # Левая кнопка мыши
-                    # Проверяем клик на поле
-                    board_start_x, board_start_y = 50, 50
-                    board_end_x = board_start_x + game.board_size * game.cell_size
-                    board_end_y = board_start_y + game.board_size * game.cell_size
-                    
-                    if (board_start_x <= mouse_pos[0] < board_end_x and 
-                        board_start_y <= mouse_pos[1] < board_end_y):
-                        
-                        # Вычисляем координаты клетки
-                        rel_x = mouse_pos[0] - board_start_x
-                        rel_y = mouse_pos[1] - board_start_y
-                        
-                        # Привязка к клетке
-                        cell_x = int(rel_x // game.cell_size)
-                        cell_y = int(rel_y // game.cell_size)
+                    # Клетка поля под курсором
+                    cell = game.screen_to_cell(mouse_pos)
+                    if cell is not None:
+                        cell_x, cell_y = cell
                         
                         # Устанавливаем фигуру
                         game.offset_x = max(0, min(cell_x, game.board_size - game.current_rect.width))
                         game.offset_y = max(0, min(cell_y, game.board_size - game.current_rect.height))
                         
                         # Пытаемся поставить фигуру
-                        if game.place_rect(game.offset_x, game.offset_y):
-                            # Ход компьютера в PvC режиме
-                            if game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
-                                pygame.time.set_timer(pygame.USEREVENT, 500)
+                        game.place_rect(game.offset_x, game.offset_y)
                 
                 # Поворот колесом мыши
                 elif event.button == 4:  # Колесо вверх
-                    game.rotation = 1 - game.rotation
-                    game.create_current_rect()
-                    game.update_valid_positions()
+                    game.rotate()
                 elif event.button == 5:  # Колесо вниз
-                    game.rotation = 1 - game.rotation
-                    game.create_current_rect()
-                    game.update_valid_positions()
+                    game.rotate()
             
             # Перемещение фигуры мышью
             if event.type == pygame.MOUSEMOTION and game.state == "playing" and not game.game_over:
-                board_start_x, board_start_y = 50, 50
-                board_end_x = board_start_x + game.board_size * game.cell_size
-                board_end_y = board_start_y + game.board_size * game.cell_size
-                
-                if (board_start_x <= mouse_pos[0] < board_end_x and 
-                    board_start_y <= mouse_pos[1] < board_end_y):
-                    
-                    # Вычисляем координаты клетки под курсором
-                    rel_x = mouse_pos[0] - board_start_x
-                    rel_y = mouse_pos[1] - board_start_y
-                    
-                    # Привязка к клетке
-                    cell_x = int(rel_x // game.cell_size)
-                    cell_y = int(rel_y // game.cell_size)
+                # Клетка поля под курсором
+                cell = game.screen_to_cell(mouse_pos)
+                if cell is not None:
+                    cell_x, cell_y = cell
                     
                     # Устанавливаем фигуру
                     game.offset_x = max(0, min(cell_x, game.board_size - game.current_rect.width))
                     game.offset_y = max(0, min(cell_y, game.board_size - game.current_rect.height))
-            
-            # Ход компьютера по таймеру
-            if event.type == pygame.USEREVENT and game.state == "playing":
-                if game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
-                    game.bot_move()
-                    pygame.time.set_timer(pygame.USEREVENT, 0)  # Отключаем таймер
-        
-        # Автоматический ход компьютера
-        if (game.state == "playing" and game.game_mode == "pvc" and 
-            game.current_player == 1 and not game.game_over and 
-            not any(event.type == pygame.USEREVENT for event in pygame.event.get())):
-            pygame.time.set_timer(pygame.USEREVENT, 500)
-        
-        # Отрисовка
-        game.draw(screen)
-        pygame.display.flip()
+        game.frame_times.phase("события")
+        
+        # Ход компьютера выбирается в фоновом потоке, окно тем временем рисуется
+        if game.state == "playing" and game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
+            if not game.bot_worker.pending:
+                game.bot_worker.start(delay=0.5)
+            ready, move = game.bot_worker.poll()
+            if ready:
+                game.play_bot_move(move)
+                redraw = True
+        game.frame_times.phase("бот")
+        
+        game.autosave()
+        game.frame_times.phase("сохранение")
+        
+        # Отрисовка: на экран выводятся только изменившиеся области
+        if redraw:
+            pygame.display.update(game.draw(screen))
+            redraw = game.show_perf  # Панель производительности обновляется каждый кадр
+        game.frame_times.phase("отрисовка")
+        game.frame_times.end_frame()
+        game.check_profile()
         clock.tick(60)
 
 if __name__ == "__main__":
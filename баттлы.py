@@ -1,7 +1,7 @@
 import pygame
-import random
 import sys
 import numpy as np
+from движок import BotWorker, Engine
 
 # Инициализация Pygame
 pygame.init()
@@ -20,258 +20,83 @@ WIN_COLOR = (255, 215, 0)
 
 # Настройки окна
 WIDTH, HEIGHT = 1200, 800
+BOT_POLL_MS = 50  # Как часто простаивающее окно проверяет, выбрал ли компьютер ход
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 pygame.display.set_caption("Прямоугольные битвы")
 font = pygame.font.SysFont('Arial', 24)
 title_font = pygame.font.SysFont('Arial', 40, bold=True)
 
-class Game:
+class Game(Engine):
     def __init__(self):
+        # Две стороны, кубики бросаются на каждом ходу, бот ходит ближе к противнику
+        super().__init__(max_queue_size=0, bot_strategy="nearest")
         self.state = "menu"
-        self.board_size = 0
         self.cell_size = 0
-        self.board = None
-        self.players = []
-        self.current_player = 0
-        self.dice_result = (0, 0)
-        self.current_rect = None
         self.game_mode = ""
         self.offset_x = 0
         self.offset_y = 0
-        self.rotation = 0
-        self.placed_rects = {0: [], 1: []}
-        self.valid_positions = set()
         self.selected_size = 50
         self.selected_mode = ""
-        self.first_move = {0: True, 1: True}
-        self.skip_turn_available = False
-        self.game_over = False
-        self.winner = None
-        self.player_scores = [0, 0]
+        self.bot_worker = BotWorker(self)  # Ход компьютера в фоновом потоке
+        self.board_surface = None  # Неизменный между ходами слой поля: сетка и фигуры
+        self.shown_frame = None  # Состояние, показанное в прошлом кадре (None - обновить весь экран)
+        self.shown_ghost = None  # Область текущей фигуры в прошлом кадре
+        self.turn_surface = None  # Кэш слоя поля с допустимыми позициями: (ключ, поверхность)
 
     def start_game(self):
         self.cell_size = min(HEIGHT // (self.board_size + 4), 16)
-        self.board = np.zeros((self.board_size, self.board_size), dtype=int)
-        self.players = [Player(0), Player(1)]
-        self.current_player = 0
-        self.dice_result = (0, 0)
-        self.current_rect = None
         self.offset_x = 0
         self.offset_y = 0
-        self.rotation = 0
-        self.placed_rects = {0: [], 1: []}
-        self.valid_positions = set()
         self.state = "playing"
-        self.first_move = {0: True, 1: True}
-        self.skip_turn_available = False
-        self.game_over = False
-        self.winner = None
-        self.player_scores = [0, 0]
-        self.roll_dice()
+        self.board_surface = None
+        self.turn_surface = None
+        self.shown_frame = None
+        self.bot_worker.cancel()
+        super().start_game()
 
-    def roll_dice(self):
-        self.dice_result = (random.randint(1, 6), random.randint(1, 6))
-        self.create_current_rect()
-        self.update_valid_positions()
-        
-        # Если нет доступных ходов, предлагаем пропустить ход
-        if not self.valid_positions:
-            self.skip_turn_available = True
-
-    def create_current_rect(self):
-        w, h = self.dice_result
-        if self.rotation == 1:
-            w, h = h, w
-        self.current_rect = pygame.Rect(0, 0, w, h)
-
-    def update_valid_positions(self):
-        self.valid_positions.clear()
-        
-        # Для первого хода - только углы
-        if self.first_move[self.current_player]:
-            # Первый игрок ставит в левый верхний угол
-            if self.current_player == 0:
-                self.valid_positions = {(0, 0)}
-            # Второй игрок ставит в диагонально противоположный угол
-            else:
-                x = self.board_size - self.current_rect.width
-                y = self.board_size - self.current_rect.height
-                self.valid_positions = {(x, y)}
-            return
-
-        for y in range(self.board_size - self.current_rect.height + 1):
-            for x in range(self.board_size - self.current_rect.width + 1):
-                if self.can_place(x, y):
-                    self.valid_positions.add((x, y))
-
-    def can_place(self, x, y):
-        # Проверка выхода за границы
-        if x < 0 or y < 0 or x + self.current_rect.width > self.board_size or y + self.current_rect.height > self.board_size:
-            return False
-        
-        # Проверка пересечения с другими фигурами
-        for i in range(y, y + self.current_rect.height):
-            for j in range(x, x + self.current_rect.width):
-                if self.board[i][j] != 0:
-                    return False
-        
-        # Для первого хода каждого игрока разрешаем ставить без примыкания
-        if self.first_move[self.current_player]:
-            return True
-        
-        # Новая механика: как минимум одна сторона должна перекрываться с уже стоящими фигурами
-        has_overlapping_side = False
-        
-        # Проверка левой границы - должна перекрываться полностью
-        if x > 0:
-            full_overlap = True
-            for i in range(y, y + self.current_rect.height):
-                if self.board[i][x-1] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        # Проверка правой границы - должна перекрываться полностью
-        if x + self.current_rect.width < self.board_size:
-            full_overlap = True
-            for i in range(y, y + self.current_rect.height):
-                if self.board[i][x + self.current_rect.width] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        # Проверка верхней границы - должна перекрываться полностью
-        if y > 0:
-            full_overlap = True
-            for j in range(x, x + self.current_rect.width):
-                if self.board[y-1][j] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        # Проверка нижней границы - должна перекрываться полностью
-        if y + self.current_rect.height < self.board_size:
-            full_overlap = True
-            for j in range(x, x + self.current_rect.width):
-                if self.board[y + self.current_rect.height][j] != self.current_player + 1:
-                    full_overlap = False
-                    break
-            if full_overlap:
-                has_overlapping_side = True
-        
-        return has_overlapping_side
+    def play_bot_move(self, move):
+        moved = super().play_bot_move(move)
+        if moved:
+            # Курсор остается на фигуре, которую поставил компьютер
+            self.offset_x, self.offset_y = self.last_move[:2]
+        return moved
 
     def place_rect(self, x, y):
-        if (x, y) not in self.valid_positions:
-            return False
-        
-        # Занимаем клетки
-        for i in range(y, y + self.current_rect.height):
-            for j in range(x, x + self.current_rect.width):
-                self.board[i][j] = self.current_player + 1
-        
-        # Сохраняем прямоугольник
-        rect_data = (x, y, self.current_rect.width, self.current_rect.height)
-        self.placed_rects[self.current_player].append(rect_data)
-        
-        # Сбрасываем флаг первого хода после размещения
-        if self.first_move[self.current_player]:
-            self.first_move[self.current_player] = False
-        
-        # Переход хода
-        self.current_player = 1 - self.current_player
-        self.rotation = 0  # Сброс поворота для следующего игрока
-        self.skip_turn_available = False
-        self.roll_dice()
-        
-        return True
-
-    def skip_turn(self):
-        """Пропустить ход"""
-        self.current_player = 1 - self.current_player
-        self.rotation = 0
-        self.skip_turn_available = False
-        self.roll_dice()
-        
-        # Проверяем, может ли следующий игрок сделать ход
-        if not self.valid_positions:
-            self.skip_turn_available = True
-
-    def end_game(self):
-        """Завершение игры и подсчет очков"""
-        self.game_over = True
-        
-        # Подсчет очков: занятые клетки
-        player1_score = np.sum(self.board == 1)
-        player2_score = np.sum(self.board == 2)
-        
-        self.player_scores = [player1_score, player2_score]
-        
-        # Определение победителя
-        if player1_score > player2_score:
-            self.winner = 0
-        elif player2_score > player1_score:
-            self.winner = 1
-        else:
-            self.winner = None  # Ничья
-
-    def bot_move(self):
-        if not self.valid_positions:
-            # Если нет валидных позиций, пропускаем ход
-            self.skip_turn()
-            return False
-        
-        # Простая стратегия бота: ставить фигуру как можно ближе к противнику
-        best_pos = None
-        min_distance = float('inf')
-        
-        # Ищем позицию, ближайшую к фигурам противника
-        for pos in self.valid_positions:
-            x, y = pos
-            distance = self.get_distance_to_opponent(x, y)
-            if distance < min_distance:
-                min_distance = distance
-                best_pos = pos
-        
-        if best_pos:
-            x, y = best_pos
-            self.offset_x = x
-            self.offset_y = y
-            self.place_rect(x, y)
-        else:
-            # Если не нашли хорошую позицию, ставим в случайное место
-            x, y = random.choice(list(self.valid_positions))
-            self.offset_x = x
-            self.offset_y = y
-            self.place_rect(x, y)
-        
-        return True
-
-    def get_distance_to_opponent(self, x, y):
-        """Вычисляет минимальное расстояние до фигур противника"""
-        opponent_id = 2 if self.current_player == 0 else 1
-        min_dist = float('inf')
-        
-        # Проверяем расстояние до всех клеток противника
-        for i in range(self.board_size):
-            for j in range(self.board_size):
-                if self.board[i][j] == opponent_id:
-                    dist = abs(x - j) + abs(y - i)  # Манхэттенское расстояние
-                    min_dist = min(min_dist, dist)
-        
-        return min_dist if min_dist != float('inf') else 0
+        player = self.current_player
+        placed = super().place_rect(x, y)
+        if placed and self.board_surface is not None:
+            # Дорисовываем на слое поля только новую фигуру
+            self.draw_piece(self.board_surface, player, self.last_move)
+        return placed
 
     def draw(self, screen):
+        """Рисует кадр и возвращает области экрана, изменившиеся с прошлого кадра"""
         screen.fill(BACKGROUND)
         
         if self.state == "menu":
             self.draw_menu(screen)
-        elif self.state == "playing":
-            self.draw_board(screen)
-            self.draw_ui(screen)
+            self.shown_frame = None
+            return [screen.get_rect()]
+
+        self.draw_board(screen)
+        self.draw_ui(screen)
+
+        # Пока не было ходов, бросков и поворотов, меняется только текущая фигура под курсором
+        frame = (len(self.history), self.current_player, self.dice_result, self.rotation,
+                 self.skip_turn_available, self.game_over)
+        ghost = pygame.Rect(
+            50 + self.offset_x * self.cell_size, 50 + self.offset_y * self.cell_size,
+            self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size
+        ).inflate(10, 10)  # С запасом на рамку и точку в центре
+        if frame != self.shown_frame:
+            dirty = [screen.get_rect()]
+        elif ghost != self.shown_ghost:
+            dirty = [self.shown_ghost, ghost]
+        else:
+            dirty = []
+        self.shown_frame = frame
+        self.shown_ghost = ghost
+        return dirty
 
     def draw_menu(self, screen):
         title = title_font.render("ПРЯМОУГОЛЬНЫЕ БИТВЫ", True, TEXT_COLOR)
@@ -305,37 +130,62 @@ class Game:
             start_text = font.render("Начать игру", True, TEXT_COLOR)
             screen.blit(start_text, (start_rect.centerx - start_text.get_width()//2, start_rect.centery - start_text.get_height()//2))
 
+    def draw_piece(self, surface, player_idx, rect_data):
+        """Рисует поставленную фигуру на слое поля"""
+        x, y, w, h = rect_data
+        pygame.draw.rect(
+            surface, PLAYER_COLORS[player_idx],
+            (x * self.cell_size, y * self.cell_size, w * self.cell_size, h * self.cell_size)
+        )
+        # Границы фигур
+        pygame.draw.rect(
+            surface, (0, 0, 0),
+            (x * self.cell_size, y * self.cell_size, w * self.cell_size, h * self.cell_size),
+            1
+        )
+
+    def board_layer(self):
+        """Слой поля; целиком собирается только в начале игры"""
+        if self.board_surface is None:
+            board_width = self.board_size * self.cell_size
+            surface = pygame.Surface((board_width + 1, board_width + 1))
+            surface.fill(BACKGROUND)
+
+            # Рисуем сетку
+            for i in range(self.board_size + 1):
+                pygame.draw.line(surface, GRID_COLOR, (0, i * self.cell_size), (board_width, i * self.cell_size))
+                pygame.draw.line(surface, GRID_COLOR, (i * self.cell_size, 0), (i * self.cell_size, board_width))
+
+            # Рисуем размещенные фигуры
+            for player_idx in [0, 1]:
+                for rect_data in self.placed_rects[player_idx]:
+                    self.draw_piece(surface, player_idx, rect_data)
+            self.board_surface = surface
+        return self.board_surface
+
+    def turn_layer(self):
+        """Слой поля с подсветкой допустимых позиций; пересобирается, только когда меняется их набор"""
+        key = (len(self.history), self.current_player, self.dice_result, self.rotation)
+        if self.turn_surface is None or self.turn_surface[0] != key:
+            # Одна точка на клетку; surfarray индексирует [x, y], поэтому маска транспонирована
+            pixels = np.zeros((self.board_size, self.board_size, 3), dtype=np.uint8)
+            rows, cols = self.valid_mask.shape
+            pixels[:cols, :rows][self.valid_mask.T] = HIGHLIGHT[:3]
+            surface = pygame.surfarray.make_surface(pixels)
+            surface.set_colorkey((0, 0, 0))
+            board_width = self.board_size * self.cell_size
+            surface = pygame.transform.scale(surface, (board_width, board_width))
+            surface.set_alpha(90)
+            layer = self.board_layer().copy()
+            layer.blit(surface, (0, 0))
+            self.turn_surface = (key, layer)
+        return self.turn_surface[1]
+
     def draw_board(self, screen):
         board_width = self.board_size * self.cell_size
-        board_rect = pygame.Rect(50, 50, board_width, board_width)
         
-        # Рисуем сетку
-        for i in range(self.board_size + 1):
-            pygame.draw.line(
-                screen, GRID_COLOR,
-                (50, 50 + i * self.cell_size),
-                (50 + board_width, 50 + i * self.cell_size)
-            )
-            pygame.draw.line(
-                screen, GRID_COLOR,
-                (50 + i * self.cell_size, 50),
-                (50 + i * self.cell_size, 50 + board_width)
-            )
-        
-        # Рисуем размещенные фигуры
-        for player_idx in [0, 1]:
-            for rect_data in self.placed_rects[player_idx]:
-                x, y, w, h = rect_data
-                pygame.draw.rect(
-                    screen, PLAYER_COLORS[player_idx],
-                    (50 + x * self.cell_size, 50 + y * self.cell_size, w * self.cell_size, h * self.cell_size)
-                )
-                # Границы фигур
-                pygame.draw.rect(
-                    screen, (0, 0, 0),
-                    (50 + x * self.cell_size, 50 + y * self.cell_size, w * self.cell_size, h * self.cell_size),
-                    1
-                )
+        # Сетка, фигуры и подсветка левых верхних углов допустимых позиций - одним готовым слоем
+        screen.blit(self.board_layer() if self.game_over else self.turn_layer(), (50, 50))
         
         # Рисуем текущий прямоугольник
         if self.current_rect and not self.game_over:
@@ -344,7 +194,9 @@ class Game:
             color = PLAYER_COLORS[self.current_player]
             rect_surf = pygame.Surface((self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size), pygame.SRCALPHA)
             rect_surf.fill((*color, 100))  # Полупрозрачный цвет
-            pygame.draw.rect(rect_surf, HIGHLIGHT[:3], (0, 0, self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size), 2)
+            # Рамка показывает, можно ли поставить фигуру здесь
+            outline = HIGHLIGHT[:3] if self.can_place(x, y) else WARNING_COLOR
+            pygame.draw.rect(rect_surf, outline, (0, 0, self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size), 2)
             screen.blit(rect_surf, (50 + x * self.cell_size, 50 + y * self.cell_size))
             
             # Центр фигуры
@@ -352,17 +204,6 @@ class Game:
             center_y = 50 + (y + self.current_rect.height/2) * self.cell_size
             pygame.draw.circle(screen, (255, 255, 255), (int(center_x), int(center_y)), 4)
         
-        # Подсветка валидных позиций
-        if not self.game_over:
-            for pos in self.valid_positions:
-                x, y = pos
-                pygame.draw.rect(
-                    screen, HIGHLIGHT,
-                    (50 + x * self.cell_size, 50 + y * self.cell_size, 
-                     self.current_rect.width * self.cell_size, self.current_rect.height * self.cell_size),
-                    2
-                )
-        
         # Экран окончания игры
         if self.game_over:
             overlay = pygame.Surface((board_width, board_width), pygame.SRCALPHA)
@@ -391,11 +232,8 @@ class Game:
         pygame.draw.rect(screen, UI_BORDER, info_rect, 2, border_radius=12)
         
         # Информация о игроках
-        player1_score = np.sum(self.board == 1)
-        player2_score = np.sum(self.board == 2)
-        
-        player1_text = font.render(f"Игрок 1: {player1_score} клеток", True, PLAYER_COLORS[0])
-        player2_text = font.render(f"Игрок 2: {player2_score} клеток", True, PLAYER_COLORS[1])
+        player1_text = font.render(f"Игрок 1: {self.cell_counts[0]} клеток", True, PLAYER_COLORS[0])
+        player2_text = font.render(f"Игрок 2: {self.cell_counts[1]} клеток", True, PLAYER_COLORS[1])
         screen.blit(player1_text, (info_rect.x + 20, info_rect.y + 20))
         screen.blit(player2_text, (info_rect.x + 20, info_rect.y + 60))
         
@@ -447,23 +285,31 @@ class Game:
             restart_text = font.render("ESC - в меню", True, TEXT_COLOR)
             screen.blit(restart_text, (info_rect.x + 20, info_rect.y + 200))
 
-class Player:
-    def __init__(self, player_id):
-        self.id = player_id
-        self.score = 0
-
 def main():
     game = Game()
     clock = pygame.time.Clock()
+    redraw = True  # Кадр мог измениться: были события или ход компьютера
     
     while True:
+        events = pygame.event.get()
+        if not events and not redraw:
+            # Ничего не происходит - спим до события, а пока думает компьютер, просыпаемся проверить его ход
+            event = pygame.event.wait(BOT_POLL_MS) if game.bot_worker.pending else pygame.event.wait()
+            if event.type != pygame.NOEVENT:
+                events = [event]
+        redraw = redraw or bool(events)
         mouse_pos = pygame.mouse.get_pos()
         
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
+                game.bot_worker.cancel()
                 pygame.quit()
                 sys.exit()
             
+            # Окно было перекрыто - выводим кадр целиком
+            if event.type == pygame.WINDOWEXPOSED:
+                game.shown_frame = None
+            
             if event.type == pygame.KEYDOWN:
                 if game.state == "playing":
                     if game.game_over:
@@ -471,7 +317,12 @@ def main():
                             game.state = "menu"
                     else:
                         # Управление в игре
-                        if event.key == pygame.K_UP and game.offset_y > 0:
+                        if event.key == pygame.K_ESCAPE:
+                            game.bot_worker.cancel()
+                            game.state = "menu"
+                        elif game.bot_worker.pending:
+                            pass  # Пока думает компьютер, фигура и кубики его
+                        elif event.key == pygame.K_UP and game.offset_y > 0:
                             game.offset_y -= 1
                         elif event.key == pygame.K_DOWN and game.offset_y < game.board_size - game.current_rect.height:
                             game.offset_y += 1
@@ -480,21 +331,14 @@ def main():
                         elif event.key == pygame.K_RIGHT and game.offset_x < game.board_size - game.current_rect.width:
                             game.offset_x += 1
                         elif event.key == pygame.K_r:
-                            game.rotation = 1 - game.rotation
-                            game.create_current_rect()
-                            game.update_valid_positions()
+                            game.rotate()
                         elif event.key == pygame.K_SPACE:
                             if game.skip_turn_available:
                                 game.skip_turn()
                             else:
                                 game.roll_dice()
                         elif event.key == pygame.K_RETURN:
-                            if game.place_rect(game.offset_x, game.offset_y):
-                                # Ход компьютера в PvC режиме
-                                if game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
-                                    pygame.time.set_timer(pygame.USEREVENT, 500)
-                        elif event.key == pygame.K_ESCAPE:
-                            game.state = "menu"
+                            game.place_rect(game.offset_x, game.offset_y)
             
             # Обработка мыши в меню
             if event.type == pygame.MOUSEBUTTONDOWN and game.state == "menu":
@@ -521,7 +365,8 @@ def main():
                         game.start_game()
             
             # Обработка мыши в игре
-            if event.type == pygame.MOUSEBUTTONDOWN and game.state == "playing" and not game.game_over:
+            if (event.type == pygame.MOUSEBUTTONDOWN and game.state == "playing" and not game.game_over
+                    and not game.bot_worker.pending):
                 if event.button == 1:  # Левая кнопка мыши
                     # Проверяем клик на поле
                     board_start_x, board_start_y = 50, 50
@@ -544,20 +389,13 @@ def main():
                         game.offset_y = max(0, min(cell_y, game.board_size - game.current_rect.height))
                         
                         # Пытаемся поставить фигуру
-                        if game.place_rect(game.offset_x, game.offset_y):
-                            # Ход компьютера в PvC режиме
-                            if game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
-                                pygame.time.set_timer(pygame.USEREVENT, 500)
+                        game.place_rect(game.offset_x, game.offset_y)
                 
                 # Поворот колесом мыши
                 elif event.button == 4:  # Колесо вверх
-                    game.rotation = 1 - game.rotation
-                    game.create_current_rect()
-                    game.update_valid_positions()
+                    game.rotate()
                 elif event.button == 5:  # Колесо вниз
-                    game.rotation = 1 - game.rotation
-                    game.create_current_rect()
-                    game.update_valid_positions()
+                    game.rotate()
             
             # Перемещение фигуры мышью
             if event.type == pygame.MOUSEMOTION and game.state == "playing" and not game.game_over:
@@ -579,22 +417,20 @@ def main():
                     # Устанавливаем фигуру
                     game.offset_x = max(0, min(cell_x, game.board_size - game.current_rect.width))
                     game.offset_y = max(0, min(cell_y, game.board_size - game.current_rect.height))
-            
-            # Ход компьютера по таймеру
-            if event.type == pygame.USEREVENT and game.state == "playing":
-                if game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
-                    game.bot_move()
-                    pygame.time.set_timer(pygame.USEREVENT, 0)  # Отключаем таймер
-        
-        # Автоматический ход компьютера
-        if (game.state == "playing" and game.game_mode == "pvc" and 
-            game.current_player == 1 and not game.game_over and 
-            not any(event.type == pygame.USEREVENT for event in pygame.event.get())):
-            pygame.time.set_timer(pygame.USEREVENT, 500)
         
-        # Отрисовка
-        game.draw(screen)
-        pygame.display.flip()
+        # Ход компьютера выбирается в фоновом потоке, окно тем временем рисуется
+        if game.state == "playing" and game.game_mode == "pvc" and game.current_player == 1 and not game.game_over:
+            if not game.bot_worker.pending:
+                game.bot_worker.start(delay=0.5)
+            ready, move = game.bot_worker.poll()
+            if ready:
+                game.play_bot_move(move)
+                redraw = True
+        
+        # Отрисовка: на экран выводятся только изменившиеся области
+        if redraw:
+            pygame.display.update(game.draw(screen))
+            redraw = False
         clock.tick(60)
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+"""Замеры горячих мест правил, бота и отрисовки на позициях с фиксированным seed.
+
+Позиции - партии бот против бота на полях 50, 100 и 150, остановленные при
+заполнении 10%, 50% и 90% клеток. Итоги пишутся в JSON и сравниваются с
+сохраненным базовым замером: замедление больше порога завершает запуск с ошибкой.
+
+Пример:
+    python бенчмарк.py --output baseline.json
+    python бенчмарк.py --baseline baseline.json --threshold 0.25
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from движок import Engine, dice_stream
+from запись import load_snapshot, read_snapshot, restore_snapshot, save_snapshot
+
+# Замер: setup перед каждым повтором (не входит во время), run - замеряемый вызов,
+# number - сколько операций делает run (время делится на него)
+Case = namedtuple("Case", "setup run number")
+
+BENCHMARKS = {}  # Название -> (функция, строящая Case по позиции, нужно ли окно)
+
+
+def benchmark(name, ui=False):
+    def register(make_case):
+        BENCHMARKS[name] = (make_case, ui)
+        return make_case
+    return register
+
+
+def generate_positions(size, fills, seed, directory):
+    """Снимки одной партии бот против бота в моменты, когда заполнено не меньше fills клеток; возвращает пути"""
+    engine = Engine(board_size=size, num_players=2, seed=seed)
+    engine.use_dice_stream(dice_stream(seed, size * size * 2))
+    engine.start_game()
+
+    positions = {}
+    idle = 0
+    for fill in sorted(fills):
+        while np.count_nonzero(engine.board) < fill * engine.board.size:
+            if engine.bot_move():
+                idle = 0
+                continue
+            idle += 1
+            if idle >= engine.num_players and not any(engine.has_any_move(p) for p in range(engine.num_players)):
+                break  # Партия кончилась раньше - берем последнюю позицию
+        # Снимок в формате сохранения окна - его же загружает и окно
+        positions[fill] = os.path.join(directory, f"{size}_{round(fill * 100)}.npz")
+        save_snapshot(engine, positions[fill], mode="pvp", bot="evaluate")
+    return positions
+
+
+def position_engine(path):
+    engine = Engine()
+    load_snapshot(engine, path)
+    return engine
+
+
+@benchmark("update_valid_positions")
+def bench_update_valid_positions(path):
+    """Маска допустимых позиций текущей фигуры с пустым кэшем, как после загрузки партии"""
+    engine = position_engine(path)
+    return Case(engine.legality.invalidate, engine.update_valid_positions, 1)
+
+
+@benchmark("can_place")
+def bench_can_place(path):
+    """Проверка тысячи случайных позиций"""
+    engine = position_engine(path)
+    rng = np.random.default_rng(0)
+    positions = rng.integers(0, engine.board_size, size=(1000, 2)).tolist()
+
+    def run():
+        for x, y in positions:
+            engine.can_place(x, y)
+    return Case(None, run, len(positions))
+
+
+@benchmark("bot_move")
+def bench_bot_move(path):
+    """Ход бота с оценкой позиций; каждый повтор - из одной и той же позиции"""
+    engine = Engine()
+    snapshot = read_snapshot(path)
+
+    def setup():
+        restore_snapshot(engine, snapshot)
+        # Карты расстояний в игре обновляются по ходу, после загрузки их строит первый ход
+        engine.get_distance_field(1)
+        engine.get_distance_field(2)
+    return Case(setup, engine.bot_move, 1)
+
+
+@benchmark("get_distance_to_opponent")
+def bench_get_distance_to_opponent(path):
+    """Расстояние до противника из тысячи клеток, начиная с построения карты расстояний"""
+    engine = position_engine(path)
+    rng = np.random.default_rng(0)
+    positions = rng.integers(0, engine.board_size, size=(1000, 2)).tolist()
+
+    def run():
+        for x, y in positions:
+            engine.get_distance_to_opponent(x, y)
+    return Case(engine.distance_fields.clear, run, len(positions))
+
+
+@benchmark("connects_opposite_sides")
+def bench_connects_opposite_sides(path):
+    engine = position_engine(path)
+    return Case(None, lambda: engine.connects_opposite_sides(1), 1)
+
+
+@benchmark("find_blocked_cells")
+def bench_find_blocked_cells(path):
+    engine = position_engine(path)
+    return Case(None, lambda: engine.find_blocked_cells(1), 1)
+
+
+@benchmark("find_frontier_lines")
+def bench_find_frontier_lines(path):
+    engine = position_engine(path)
+    return Case(None, lambda: engine.find_frontier_lines(1), 1)
+
+
+@benchmark("draw_board", ui=True)
+def bench_draw_board(path, ui):
+    """Кадр поля после хода: видимая часть строится заново"""
+    game = ui_game(path, ui)
+
+    def setup():
+        game.view_surface = None
+    return Case(setup, lambda: game.draw_board(ui.screen), 1)
+
+
+@benchmark("draw_ui", ui=True)
+def bench_draw_ui(path, ui):
+    game = ui_game(path, ui)
+    return Case(None, lambda: game.draw_ui(ui.screen), 1)
+
+
+def load_ui():
+    """Модуль окна 0.2 с окном без экрана (SDL_VIDEODRIVER=dummy) или None, если нет pygame"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    try:
+        import pygame  # noqa: F401
+    except ImportError:
+        return None
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "баттлы 0.2.py")
+    spec = importlib.util.spec_from_file_location("баттлы_02", path)
+    ui = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ui)
+    ui.init_display()
+    return ui
+
+
+def ui_game(path, ui):
+    """Партия окна в позиции снимка - так же, как ее продолжает кнопка «Продолжить»"""
+    game = ui.Game()
+    if not game.load_game(path):
+        # Иначе замерялось бы пустое меню
+        raise RuntimeError(f"окно не загрузило позицию {path}: {game.menu_message}")
+    return game
+
+
+def measure(case, repeat):
+    """Медиана и минимум времени одной операции в микросекундах"""
+    times = []
+    for i in range(repeat + 1):
+        if case.setup is not None:
+            case.setup()
+        started = time.perf_counter()
+        case.run()
+        elapsed = (time.perf_counter() - started) / case.number * 1e6
+        if i:  # Первый повтор - прогрев
+            times.append(elapsed)
+    return statistics.median(times), min(times)
+
+
+def run_benchmarks(args):
+    ui = load_ui() if any(BENCHMARKS[name][1] for name in args.benchmarks) else None
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            positions = generate_positions(size, args.fills, args.seed, directory)
+            for fill, path in positions.items():
+                for name in args.benchmarks:
+                    make_case, needs_ui = BENCHMARKS[name]
+                    if needs_ui and ui is None:
+                        continue
+                    case = make_case(path, ui) if needs_ui else make_case(path)
+                    median, best = measure(case, args.repeat)
+                    key = f"{name}/{size}/{round(fill * 100)}"
+                    results[key] = {"median_us": round(median, 3), "min_us": round(best, 3)}
+                    print(f"{key:40} {median:12.1f} мкс (мин. {best:.1f})", file=sys.stderr)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pygame": None if ui is None else ui.pygame.version.ver,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold, stream):
+    """Печатает сравнение с базовым замером и возвращает замеры, ставшие медленнее порога"""
+    regressions = []
+    for key, result in report["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        change = result["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+        slower = change > threshold
+        if slower:
+            regressions.append(key)
+        print(f"{key:40} {base['median_us']:12.1f} -> {result['median_us']:12.1f} мкс {change:+8.1%}"
+              f"{'  МЕДЛЕННЕЕ' if slower else ''}", file=stream)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры правил, бота и отрисовки")
+    parser.add_argument("--sizes", default="50,100,150", help="размеры полей через запятую")
+    parser.add_argument("--fills", default="10,50,90", help="заполнение поля в процентах через запятую")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="замеры через запятую")
+    parser.add_argument("--seed", type=int, default=0, help="seed партий, из которых берутся позиции")
+    parser.add_argument("--repeat", type=int, default=15, help="повторов каждого замера")
+    parser.add_argument("--output", default=None, help="файл для итогов в JSON")
+    parser.add_argument("--baseline", default=None, help="базовый замер в JSON для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="допустимое замедление медианы относительно базового замера (0.25 - на 25%%)")
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.fills = [int(fill) / 100 for fill in args.fills.split(",")]
+    args.benchmarks = args.benchmarks.split(",")
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"неизвестный замер: {name}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, indent=2, ensure_ascii=False)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as stream:
+            baseline = json.load(stream)
+        regressions = compare(report, baseline, args.threshold, sys.stderr)
+        if regressions:
+            print(f"Медленнее базового замера больше чем на {args.threshold:.0%}: {', '.join(regressions)}",
+                  file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
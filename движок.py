@@ -0,0 +1,1046 @@
+import functools
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+
+# Размер текущей фигуры (ширина и высота в клетках)
+Piece = namedtuple("Piece", "width height")
+
+
+def integral_image(mask):
+    """Интегральное изображение (таблица сумм) с нулевой первой строкой и столбцом"""
+    table = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int32), axis=1, out=table[1:, 1:])
+    return table
+
+
+def legal_mask(board, width, height, player_id, require_side=True):
+    """Маска допустимых позиций прямоугольника width x height.
+
+    mask[y, x] == True, если фигуру можно поставить левым верхним углом в (x, y):
+    прямоугольник пуст и (если require_side) хотя бы одна его сторона
+    полностью примыкает к клеткам игрока player_id.
+    """
+    rows, cols = board.shape
+    ny = rows - height + 1
+    nx = cols - width + 1
+    if ny <= 0 or nx <= 0:
+        return np.zeros((max(ny, 0), max(nx, 0)), dtype=bool)
+
+    # Проверка пересечения: сумма пустых клеток в прямоугольнике равна его площади
+    empty = integral_image(board == 0)
+    area = (empty[height:height + ny, width:width + nx] - empty[0:ny, width:width + nx]
+            - empty[height:height + ny, 0:nx] + empty[0:ny, 0:nx])
+    mask = area == width * height
+
+    if not require_side:
+        return mask
+
+    own = board == player_id
+
+    # Столбцы из height клеток игрока подряд (для левой и правой стороны)
+    col_sums = np.zeros((rows + 1, cols), dtype=np.int32)
+    np.cumsum(own, axis=0, dtype=np.int32, out=col_sums[1:])
+    full_cols = (col_sums[height:height + ny] - col_sums[0:ny]) == height
+
+    # Строки из width клеток игрока подряд (для верхней и нижней стороны)
+    row_sums = np.zeros((rows, cols + 1), dtype=np.int32)
+    np.cumsum(own, axis=1, dtype=np.int32, out=row_sums[:, 1:])
+    full_rows = (row_sums[:, width:width + nx] - row_sums[:, 0:nx]) == width
+
+    # Сторона должна перекрываться полностью: левая, правая, верхняя, нижняя
+    side = np.zeros((ny, nx), dtype=bool)
+    side[:, 1:] |= full_cols[:, 0:nx - 1]
+    side[:, :nx - 1] |= full_cols[:, width:width + nx - 1]
+    side[1:, :] |= full_rows[0:ny - 1, :]
+    side[:ny - 1, :] |= full_rows[height:height + ny - 1, :]
+
+    return mask & side
+
+
+def distance_field(board, player_id):
+    """Манхэттенское расстояние от каждой клетки до ближайшей клетки игрока player_id.
+
+    Считается двумя проходами (по строкам и по столбцам) вперед и назад;
+    если у игрока нет клеток, везде np.inf.
+    """
+    field = np.where(board == player_id, 0.0, np.inf)
+    for axis in (1, 0):
+        index = np.arange(field.shape[axis], dtype=float)
+        if axis == 0:
+            index = index[:, None]
+        # d[j] = min(d[j'] + |j - j'|): слева направо, затем справа налево
+        field = np.minimum.accumulate(field - index, axis=axis) + index
+        reverse = np.flip(field + index, axis=axis)
+        field = np.minimum(field, np.flip(np.minimum.accumulate(reverse, axis=axis), axis=axis) - index)
+    return field
+
+
+def rect_distance(shape, x, y, width, height):
+    """Манхэттенское расстояние от каждой клетки поля до прямоугольника"""
+    rows = np.arange(shape[0])
+    cols = np.arange(shape[1])
+    dy = np.maximum(np.maximum(y - rows, rows - (y + height - 1)), 0)
+    dx = np.maximum(np.maximum(x - cols, cols - (x + width - 1)), 0)
+    return dy[:, None] + dx[None, :]
+
+
+def corner_position(board_size, num_players, player, width, height):
+    """Позиция первого хода игрока: свой угол поля"""
+    corner_positions = {
+        0: (0, 0),                                    # Левый верхний
+        1: (board_size - width, board_size - height),  # Правый нижний
+    }
+
+    # Для 3-4 игроков добавляем еще углы
+    if num_players >= 3:
+        corner_positions[2] = (board_size - width, 0)  # Правый верхний
+    if num_players >= 4:
+        corner_positions[3] = (0, board_size - height)  # Левый нижний
+
+    return corner_positions.get(player, (0, 0))
+
+
+def dice_stream(seed, length):
+    """Все броски партии заранее, одним вызовом NumPy: массив (length, 2) значений от 1 до 6"""
+    return np.random.default_rng(seed).integers(1, 7, size=(length, 2), dtype=np.uint8)
+
+
+def timed(operation):
+    """Время метода попадает в гистограмму operation engine.metrics, если метрики включены"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.observe(operation, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def opponent_of(player):
+    """Противник, к которому тянется бот (пока логика для 2 игроков)"""
+    return 2 if player == 0 else 1
+
+
+def position_scores(xs, ys, width, height, board_size, opponent_distance):
+    """Оценки позиций (xs, ys) для фигуры width x height.
+
+    opponent_distance - расстояния от этих позиций до противника (np.inf, если его клеток нет).
+    """
+    # Бонус за близость к противнику
+    distance_to_opponent = np.where(np.isinf(opponent_distance), 0, opponent_distance)
+    scores = np.maximum(0, 100 - distance_to_opponent * 2)
+
+    # Бонус за контроль центра
+    center_x, center_y = board_size // 2, board_size // 2
+    distance_to_center = np.abs(xs - center_x) + np.abs(ys - center_y)
+    scores += np.maximum(0, 50 - distance_to_center)
+
+    # Бонус за размер фигуры
+    scores += width * height * 3
+
+    # Штраф за слишком близкое расположение к краям
+    near_edge = (xs < 2) | (ys < 2) | (xs + width > board_size - 2) | (ys + height > board_size - 2)
+    scores -= 20 * near_edge
+
+    return scores
+
+
+def merge_runs(mask):
+    """Максимальные непрерывные отрезки True в строках маски: [(строка, начало, конец), ...]"""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    step = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(step == 1)
+    _, ends = np.nonzero(step == -1)
+    return list(zip(rows.tolist(), starts.tolist(), ends.tolist()))
+
+
+def run_minimum(labels, passable):
+    """Наименьшая метка вдоль каждого непрерывного отрезка проходимых клеток в строках"""
+    starts = passable.copy()
+    starts[:, 1:] &= ~passable[:, :-1]
+    starts = starts.ravel()
+    if not starts.any():
+        return labels
+    # Отрезок от начала до следующего начала захватывает только непроходимые клетки с максимальной меткой
+    minimums = np.minimum.reduceat(labels.ravel(), np.flatnonzero(starts))
+    runs = np.cumsum(starts) - 1
+    return np.where(passable, minimums[runs].reshape(labels.shape), labels)
+
+
+def label_regions(passable):
+    """Разметка 4-связных областей маски: метка клетки - наименьший плоский индекс клетки ее области, -1 вне маски"""
+    rows, cols = passable.shape
+    outside = rows * cols  # Метка непроходимых клеток на время разметки, больше любой настоящей
+    labels = np.where(passable, np.arange(outside).reshape(rows, cols), outside)
+
+    while True:
+        previous = labels
+        # Протягиваем меньшую метку вдоль отрезков строк и столбцов
+        labels = run_minimum(labels, passable)
+        labels = run_minimum(labels.T, passable.T).T
+        # Перескок по указателям: метка клетки - индекс клетки той же области с меткой не больше
+        labels = np.append(labels.ravel(), outside)[labels]
+        if np.array_equal(labels, previous):
+            break
+
+    labels[labels == outside] = -1
+    return labels
+
+
+def blocked_cells(board, blocking_player):
+    """Незанятые клетки, которые blocking_player отрезал от верхнего и левого края поля.
+
+    Возвращает маску таких клеток и разметку областей вне клеток blocking_player.
+    """
+    labels = label_regions(board != blocking_player)
+
+    # Доступны области, выходящие на верхний или левый край поля
+    edges = np.concatenate((labels[0], labels[:, 0]))
+    accessible = np.isin(labels, edges[edges >= 0])
+
+    # Все незанятые клетки, которые не доступны, считаются заблокированными
+    return (board == 0) & ~accessible, labels
+
+
+class Zobrist:
+    """Случайные 64-битные ключи Зобриста: владелец каждой клетки, очередь хода,
+    флаги первого хода и фигуры (текущая и из очереди)"""
+
+    def __init__(self, board_size, num_players, queue_size=3, seed=0):
+        rng = np.random.default_rng(seed)
+        top = np.iinfo(np.uint64).max
+        self.cells = rng.integers(top, size=(num_players, board_size, board_size), dtype=np.uint64, endpoint=True)
+        self.turn = [int(key) for key in rng.integers(top, size=num_players, dtype=np.uint64, endpoint=True)]
+        self.first = [int(key) for key in rng.integers(top, size=num_players, dtype=np.uint64, endpoint=True)]
+        self.pieces = rng.integers(top, size=(queue_size + 1, 6, 6), dtype=np.uint64, endpoint=True)
+
+    def rect(self, player_id, x, y, width, height):
+        """Ключ фигуры игрока: XOR ключей ее клеток"""
+        return int(np.bitwise_xor.reduce(self.cells[player_id - 1, y:y + height, x:x + width], axis=None))
+
+    def board(self, board, first_move):
+        """Ключ доски и флагов первого хода полным пересчетом - только для позиции из снимка"""
+        key = 0
+        for player in range(self.cells.shape[0]):
+            owned = self.cells[player][board == player + 1]
+            if owned.size:
+                key ^= int(np.bitwise_xor.reduce(owned))
+            if first_move[player]:
+                key ^= self.first[player]
+        return key
+
+    def sequence(self, pieces):
+        """Ключ последовательности фигур: текущей и следующих из очереди"""
+        key = 0
+        for slot, (w, h) in enumerate(pieces[:len(self.pieces)]):
+            key ^= int(self.pieces[slot, w - 1, h - 1])
+        return key
+
+
+class SideConnectivity:
+    """Система непересекающихся множеств клеток одного игрока.
+
+    Кроме клеток в ней есть четыре виртуальных узла - стороны поля, поэтому
+    соединение противоположных сторон проверяется сравнением двух корней.
+    Хранятся только клетки игрока и стороны: память растет с числом клеток игрока, а не поля.
+    """
+
+    SIDES = {'top': 0, 'bottom': 1, 'left': 2, 'right': 3}
+
+    def __init__(self, board_size, metrics=None):
+        self.size = board_size
+        sides = board_size * board_size
+        self.parent = {sides + side: sides + side for side in self.SIDES.values()}  # Узел -> родитель
+        self.rank = {}  # Узел -> ранг, если он не 0
+        self.metrics = metrics  # Счетчик объединений, см. Engine.metrics
+
+    def find(self, node):
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]  # Сокращение пути вдвое
+            node = parent[node]
+        return node
+
+    def union(self, a, b):
+        if self.metrics is not None:
+            self.metrics.count("connectivity_unions")
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        rank_a, rank_b = self.rank.get(a, 0), self.rank.get(b, 0)
+        if rank_a < rank_b:
+            a, b = b, a
+        self.parent[b] = a
+        if rank_a == rank_b:
+            self.rank[a] = rank_a + 1
+
+    def add_cells(self, cells):
+        """Добавляет клетки игрока (i, j) и соединяет их с соседями и сторонами поля"""
+        size = self.size
+        sides = size * size
+        parent = self.parent
+        cells = list(cells)
+        for i, j in cells:
+            node = i * size + j
+            parent.setdefault(node, node)
+
+        for i, j in cells:
+            node = i * size + j
+            if i == 0:
+                self.union(node, sides + self.SIDES['top'])
+            if i == size - 1:
+                self.union(node, sides + self.SIDES['bottom'])
+            if j == 0:
+                self.union(node, sides + self.SIDES['left'])
+            if j == size - 1:
+                self.union(node, sides + self.SIDES['right'])
+            if i > 0 and node - size in parent:
+                self.union(node, node - size)
+            if i < size - 1 and node + size in parent:
+                self.union(node, node + size)
+            if j > 0 and node - 1 in parent:
+                self.union(node, node - 1)
+            if j < size - 1 and node + 1 in parent:
+                self.union(node, node + 1)
+
+    def add_rect(self, x, y, width, height):
+        self.add_cells((i, j) for i in range(y, y + height) for j in range(x, x + width))
+
+    def connects(self, side1, side2):
+        """Соединены ли две стороны поля клетками игрока"""
+        sides = self.size * self.size
+        return self.find(sides + self.SIDES[side1]) == self.find(sides + self.SIDES[side2])
+
+
+def pack_rows(mask):
+    """Строки маски как целые числа: бит j - клетка в столбце j"""
+    packed = np.packbits(mask, axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+
+class Bitboards:
+    """Упакованные доски: для каждого игрока и для всех занятых клеток по числу на строку.
+
+    Пересечение и примыкание стороной проверяются сдвигами и масками сразу по целым
+    строкам, без чтения доски по клеткам.
+    """
+
+    def __init__(self, board_size, num_players):
+        self.size = board_size
+        self.rows = {i + 1: [0] * board_size for i in range(num_players)}
+        self.occupied = [0] * board_size
+
+    def add_rect(self, player_id, x, y, width, height):
+        bits = ((1 << width) - 1) << x
+        own = self.rows[player_id]
+        for i in range(y, y + height):
+            own[i] |= bits
+            self.occupied[i] |= bits
+
+    def add_mask(self, player_id, mask):
+        """Добавляет игроку клетки mask[y, x]"""
+        own = self.rows[player_id]
+        for i, bits in enumerate(pack_rows(mask)):
+            own[i] |= bits
+            self.occupied[i] |= bits
+
+    def fits(self, player_id, x, y, width, height):
+        """Прямоугольник в поле, пуст и хотя бы одной стороной целиком примыкает к клеткам игрока"""
+        if x < 0 or y < 0 or x + width > self.size or y + height > self.size:
+            return False
+        bits = ((1 << width) - 1) << x
+        own = self.rows[player_id]
+        columns = -1  # Клетки игрока, занятые во всех строках фигуры
+        for i in range(y, y + height):
+            if self.occupied[i] & bits:
+                return False
+            columns &= own[i]
+
+        # Верхняя и нижняя стороны - строка над или под фигурой по всей ширине
+        if y > 0 and own[y - 1] & bits == bits:
+            return True
+        if y + height < self.size and own[y + height] & bits == bits:
+            return True
+        # Левая и правая стороны - столбец слева или справа во всех строках фигуры
+        if x > 0 and columns >> (x - 1) & 1:
+            return True
+        return bool(x + width < self.size and columns >> (x + width) & 1)
+
+    def has_free_neighbor(self, player_id):
+        """Есть ли свободная клетка рядом с клетками игрока (туда встанет фигура 1x1)"""
+        full = (1 << self.size) - 1
+        own = self.rows[player_id]
+        for i in range(self.size):
+            near = own[i] << 1 | own[i] >> 1
+            if i > 0:
+                near |= own[i - 1]
+            if i + 1 < self.size:
+                near |= own[i + 1]
+            if near & ~self.occupied[i] & full:
+                return True
+        return False
+
+
+class LegalityCache:
+    """Маски допустимых позиций для каждого игрока и каждой формы фигуры.
+
+    После размещения фигуры пересчитывается только окно вокруг нее, причем
+    лениво: маска формы догоняет доску при первом обращении к ней.
+    """
+
+    # Сколько отложенных размещений выгоднее применить окнами, а не пересчетом всей маски
+    MAX_PENDING = 16
+
+    def __init__(self, board, metrics=None):
+        self.board = board
+        self.placements = []  # Все размещения (x, y, w, h) в порядке хода
+        self.masks = {}       # (player_id, w, h) -> маска позиций
+        self.positions = {}   # (player_id, w, h) -> множество (x, y)
+        self.applied = {}     # (player_id, w, h) -> сколько размещений уже учтено
+        self.metrics = metrics  # Счетчик пересчитанных позиций, см. Engine.metrics
+
+    def update(self, x, y, width, height):
+        """Отмечает, что на доске появилась фигура width x height в (x, y)"""
+        self.placements.append((x, y, width, height))
+
+    def invalidate(self):
+        """Сбрасывает все маски (после перекраски произвольных клеток доски)"""
+        self.masks.clear()
+        self.positions.clear()
+        self.applied.clear()
+
+    def restore(self, player_id, width, height, mask):
+        """Принимает готовую актуальную маску формы (например, из снимка партии) вместо пересчета"""
+        key = (player_id, width, height)
+        ys, xs = np.nonzero(mask)
+        self.masks[key] = mask
+        self.positions[key] = set(zip(xs.tolist(), ys.tolist()))
+        self.applied[key] = len(self.placements)
+
+    def mask(self, player_id, width, height):
+        """Актуальная маска допустимых позиций для игрока и формы фигуры"""
+        key = (player_id, width, height)
+        self._sync(key)
+        return self.masks[key]
+
+    def valid_positions(self, player_id, width, height):
+        """Актуальное множество допустимых позиций (не изменять снаружи)"""
+        key = (player_id, width, height)
+        self._sync(key)
+        return self.positions[key]
+
+    def _sync(self, key):
+        done = self.applied.get(key)
+        total = len(self.placements)
+        if done == total:
+            return
+
+        if done is None or total - done > self.MAX_PENDING:
+            # Полный пересчет маски
+            mask = legal_mask(self.board, key[1], key[2], key[0])
+            ys, xs = np.nonzero(mask)
+            self.masks[key] = mask
+            self.positions[key] = set(zip(xs.tolist(), ys.tolist()))
+            if self.metrics is not None:
+                self.metrics.count("legality_cells", mask.size)
+        else:
+            for placement in self.placements[done:]:
+                self._refresh(key, *placement)
+        self.applied[key] = total
+
+    def _refresh(self, key, x, y, w, h):
+        """Пересчитывает позиции, на которые могла повлиять фигура w x h в (x, y)"""
+        player_id, width, height = key
+        mask = self.masks[key]
+        positions = self.positions[key]
+        ny, nx = mask.shape
+        rows, cols = self.board.shape
+
+        # Затронуты позиции, чей прямоугольник вместе с рамкой пересекает новую фигуру
+        px0, px1 = max(x - width, 0), min(x + w, nx - 1)
+        py0, py1 = max(y - height, 0), min(y + h, ny - 1)
+        if px0 > px1 or py0 > py1:
+            return
+
+        # Кусок доски с рамкой в одну клетку вокруг всех затронутых позиций
+        r0, c0 = max(py0 - 1, 0), max(px0 - 1, 0)
+        r1, c1 = min(py1 + height + 1, rows), min(px1 + width + 1, cols)
+        local = legal_mask(self.board[r0:r1, c0:c1], width, height, player_id)
+        window = local[py0 - r0:py1 - r0 + 1, px0 - c0:px1 - c0 + 1]
+        old = mask[py0:py1 + 1, px0:px1 + 1]
+        if self.metrics is not None:
+            self.metrics.count("legality_cells", window.size)
+
+        ys, xs = np.nonzero(old & ~window)
+        for i, j in zip(ys.tolist(), xs.tolist()):
+            positions.discard((px0 + j, py0 + i))
+        ys, xs = np.nonzero(window & ~old)
+        for i, j in zip(ys.tolist(), xs.tolist()):
+            positions.add((px0 + j, py0 + i))
+        old[...] = window
+
+
+class Player:
+    def __init__(self, player_id):
+        self.id = player_id
+        self.score = 0
+
+
+class Engine:
+    """Правила игры без интерфейса: кубики, допустимые ходы, очередность,
+    пропуски, преждевременный эндгейм и подсчет очков"""
+
+    def __init__(self, board_size=0, num_players=2, max_queue_size=3, bot_strategy="evaluate", seed=None):
+        self.board_size = board_size
+        self.board = None
+        self.players = []
+        self.current_player = 0
+        self.dice_result = (0, 0)
+        self.current_rect = None
+        self.rotation = 0
+        self.placed_rects = {0: [], 1: []}
+        self.valid_positions = set()
+        self.valid_mask = None
+        self.legality = None
+        self.bitboards = None  # Упакованные строки клеток игроков для быстрых проверок позиций
+        self.distance_fields = {}  # player_id -> расстояния до клеток игрока
+        self.connectivity = {}  # player_id -> связность клеток игрока со сторонами поля
+        self.zobrist = None  # Ключи Зобриста для этого размера поля и числа игроков
+        self.board_hash = 0  # Ключ клеток и флагов первого хода, обновляется по ходу партии
+        self.first_move = {0: True, 1: True}
+        self.skip_turn_available = False
+        self.game_over = False
+        self.winner = None
+        self.player_scores = [0, 0]
+        self.cell_counts = [0] * num_players  # Клетки каждого игрока, обновляются при каждом ходе
+        self.last_move = None  # Последняя поставленная фигура (x, y, w, h)
+        self.history = []  # Ходы партии: (игрок, кубики, (x, y, w, h) или None при пропуске)
+        self.frontier_lines = []  # Для хранения линий передового контура
+        self.premature_endgame = False
+        self.blocked_cells = np.zeros((board_size, board_size), dtype=bool)  # Клетки, заблокированные передовым контуром
+        self.region_labels = None  # Разметка областей при поиске заблокированных клеток
+        self.piece_queue = []  # Очередь следующих фигур
+        self.max_queue_size = max_queue_size  # 0 - без очереди, кубики бросаются на каждом ходу
+        self.num_players = num_players  # 2, 3 или 4
+        # "nearest" - ближе к противнику, "evaluate" - по оценке позиции,
+        # либо объект поиска с методом choose_move(engine, cancelled) -> (x, y, rotation)
+        self.bot_strategy = bot_strategy
+        self.seed = seed
+        self.rng = random.Random(seed)  # Свой генератор у каждой партии: кубики и выбор бота среди равных
+        self.dice_stream = None  # Заранее брошенные кубики - массив (n, 2), см. use_dice_stream
+        self.dice_index = 0  # Сколько бросков из dice_stream уже взято
+        # Потоковая запись партии: объект с методами move(игрок, кубики, прямоугольник или None)
+        # и premature_endgame(игрок), например запись.GameWriter
+        self.recorder = None
+        # Счетчики и время операций: объект с методами count(имя, n), observe(операция, секунды)
+        # и tick(), например метрики.Metrics; None - не считать
+        self._metrics = None
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        # Маски допустимости и связность считают свою работу сами - передаем им тот же объект
+        self._metrics = metrics
+        if self.board is not None:
+            self.legality.metrics = metrics
+            for connectivity in self.connectivity.values():
+                connectivity.metrics = metrics
+
+    def start_game(self):
+        self.board = np.zeros((self.board_size, self.board_size), dtype=np.uint8)
+        self.legality = LegalityCache(self.board, self.metrics)
+        self.bitboards = Bitboards(self.board_size, self.num_players)
+        self.distance_fields = {}
+        self.connectivity = {i + 1: SideConnectivity(self.board_size, self.metrics) for i in range(self.num_players)}
+        self.prepare_zobrist()
+        # Пустая доска, у всех игроков впереди первый ход
+        self.board_hash = 0
+        for player in range(self.num_players):
+            self.board_hash ^= self.zobrist.first[player]
+
+        # Создаем нужное количество игроков
+        self.players = [Player(i) for i in range(self.num_players)]
+        self.current_player = 0
+        self.dice_result = (0, 0)
+        self.current_rect = None
+        self.rotation = 0
+        self.placed_rects = {i: [] for i in range(self.num_players)}
+        self.valid_positions = set()
+        self.valid_mask = None
+        self.first_move = {i: True for i in range(self.num_players)}
+        self.skip_turn_available = False
+        self.game_over = False
+        self.winner = None
+        self.player_scores = [0] * self.num_players
+        self.cell_counts = [0] * self.num_players
+        self.last_move = None
+        self.history = []
+        self.piece_queue = []
+        self.premature_endgame = False
+        self.blocked_cells = np.zeros((self.board_size, self.board_size), dtype=bool)
+        self.region_labels = None
+        self.frontier_lines = []
+        self.dice_index = 0
+        self.generate_piece_queue()
+        self.roll_dice()
+
+    def prepare_zobrist(self):
+        """Ключи Зобриста для текущих размеров; создаются заново, только если размеры изменились"""
+        key_shape = (self.num_players, self.board_size, self.board_size)
+        if self.zobrist is None or self.zobrist.cells.shape != key_shape or len(self.zobrist.pieces) != self.max_queue_size + 1:
+            self.zobrist = Zobrist(self.board_size, self.num_players, queue_size=self.max_queue_size)
+
+    def use_dice_stream(self, stream):
+        """Следующие партии берут кубики из stream (массив (n, 2), например dice_stream) по порядку.
+
+        Когда броски кончаются, кубики бросает генератор партии.
+        """
+        self.dice_stream = np.asarray(stream, dtype=np.uint8).reshape(-1, 2)
+        self.dice_index = 0
+
+    def next_dice(self):
+        """Очередной бросок двух кубиков"""
+        if self.dice_stream is not None and self.dice_index < len(self.dice_stream):
+            self.dice_index += 1
+            return tuple(self.dice_stream[self.dice_index - 1].tolist())
+        return self.rng.randint(1, 6), self.rng.randint(1, 6)
+
+    def generate_piece_queue(self):
+        """Дополняет очередь следующих фигур до max_queue_size"""
+        while len(self.piece_queue) < self.max_queue_size:
+            self.piece_queue.append(self.next_dice())
+
+    def roll_dice(self):
+        # Берем первую фигуру из очереди
+        if self.piece_queue:
+            self.dice_result = self.piece_queue.pop(0)
+        else:
+            self.dice_result = self.next_dice()
+
+        self.create_current_rect()
+        self.update_valid_positions()
+
+        # Добавляем новую фигуру в очередь
+        self.generate_piece_queue()
+
+        # Если нет доступных ходов, предлагаем пропустить ход
+        if not self.valid_positions:
+            self.skip_turn_available = True
+
+    def create_current_rect(self):
+        w, h = self.dice_result
+        if self.rotation == 1:
+            w, h = h, w
+        self.current_rect = Piece(w, h)
+
+    def rotate(self):
+        """Поворачивает текущую фигуру на 90 градусов"""
+        self.rotation = 1 - self.rotation
+        self.create_current_rect()
+        self.update_valid_positions()
+
+    @timed("update_valid_positions")
+    def update_valid_positions(self):
+        # Для первого хода - углы для каждого игрока
+        if self.first_move[self.current_player]:
+            # На первом ходу единственная позиция - угол, примыкание не требуется
+            width, height = self.current_rect
+            x, y = corner_position(self.board_size, self.num_players, self.current_player, width, height)
+            self.valid_mask = np.zeros((self.board_size - height + 1, self.board_size - width + 1), dtype=bool)
+            self.valid_positions = set()
+            # На маленьком поле (или после пропущенного первого хода) угол может быть уже занят
+            if not self.board[y:y + height, x:x + width].any():
+                self.valid_mask[y, x] = True
+                self.valid_positions.add((x, y))
+            return
+
+        # Маска и позиции обновляются кэшем только вокруг новых фигур
+        args = (self.current_player + 1, self.current_rect.width, self.current_rect.height)
+        self.valid_mask = self.legality.mask(*args)
+        self.valid_positions = self.legality.valid_positions(*args)
+
+    def ordered_positions(self):
+        """Допустимые позиции списком по строкам поля: порядок не зависит от истории множества"""
+        ys, xs = np.nonzero(self.valid_mask)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def can_place(self, x, y):
+        width, height = self.current_rect
+        mask = self.valid_mask
+        if mask is not None and not self.game_over:
+            # Маска текущей фигуры пересчитывается при каждом изменении доски - проверка одним чтением
+            if x < 0 or y < 0 or x + width > self.board_size or y + height > self.board_size:
+                return False
+            return bool(mask[y, x])
+        if self.first_move[self.current_player]:
+            return (x, y) in self.valid_positions
+
+        # Маски нет (или доска изменилась после конца партии) - по упакованным строкам
+        return self.bitboards.fits(self.current_player + 1, x, y, width, height)
+
+    @timed("place_rect")
+    def place_rect(self, x, y):
+        if not self.can_place(x, y):
+            return False
+
+        # Занимаем клетки
+        self.board[y:y + self.current_rect.height, x:x + self.current_rect.width] = self.current_player + 1
+        self.bitboards.add_rect(self.current_player + 1, x, y, self.current_rect.width, self.current_rect.height)
+        self.legality.update(x, y, self.current_rect.width, self.current_rect.height)
+        self.board_hash ^= self.zobrist.rect(self.current_player + 1, x, y, self.current_rect.width, self.current_rect.height)
+        self.connectivity[self.current_player + 1].add_rect(x, y, self.current_rect.width, self.current_rect.height)
+        self.cell_counts[self.current_player] += self.current_rect.width * self.current_rect.height
+
+        # Расстояния до игрока могли только уменьшиться - до новой фигуры
+        field = self.distance_fields.get(self.current_player + 1)
+        if field is not None:
+            np.minimum(field, rect_distance(field.shape, x, y, self.current_rect.width, self.current_rect.height), out=field)
+
+        # Сохраняем прямоугольник
+        rect_data = (x, y, self.current_rect.width, self.current_rect.height)
+        self.placed_rects[self.current_player].append(rect_data)
+        self.last_move = rect_data
+        self.history.append((self.current_player, self.dice_result, rect_data))
+        if self.recorder is not None:
+            self.recorder.move(self.current_player, self.dice_result, rect_data)
+        if self.metrics is not None:
+            self.metrics.count("moves")
+            self.metrics.tick()
+
+        # Сбрасываем флаг первого хода после размещения
+        if self.first_move[self.current_player]:
+            self.first_move[self.current_player] = False
+            self.board_hash ^= self.zobrist.first[self.current_player]
+
+        # Переход хода к следующему игроку
+        self.current_player = (self.current_player + 1) % self.num_players
+        self.rotation = 0
+        self.skip_turn_available = False
+        self.roll_dice()
+
+        return True
+
+    def skip_turn(self):
+        """Пропустить ход"""
+        self.history.append((self.current_player, self.dice_result, None))
+        if self.recorder is not None:
+            self.recorder.move(self.current_player, self.dice_result, None)
+        if self.metrics is not None:
+            self.metrics.count("skips")
+            self.metrics.tick()
+        self.current_player = (self.current_player + 1) % self.num_players
+        self.rotation = 0
+        self.skip_turn_available = False
+        self.roll_dice()
+
+        # Проверяем, может ли следующий игрок сделать ход
+        if not self.valid_positions:
+            self.skip_turn_available = True
+
+    def position_hash(self):
+        """64-битный ключ позиции: клетки, флаги первого хода, чей ход и какие фигуры впереди"""
+        pieces = [self.dice_result] + self.piece_queue
+        return self.board_hash ^ self.zobrist.turn[self.current_player] ^ self.zobrist.sequence(pieces)
+
+    def has_any_move(self, player):
+        """Есть ли у игрока допустимая позиция хоть для какой-нибудь фигуры"""
+        if self.first_move[player]:
+            # Первая фигура встает только в свой угол - значит, должна быть свободна угловая клетка
+            x, y = corner_position(self.board_size, self.num_players, player, 1, 1)
+            return not self.board[y, x]
+        # Если встает любая фигура, то встает и 1x1 у ее примыкающей стороны
+        return self.bitboards.has_free_neighbor(player + 1)
+
+    def check_premature_endgame(self):
+        """Проверяет, есть ли преждевременный эндгейм"""
+        # Для каждого игрока проверяем, соединяет ли он две противоположные стороны
+        for player_id in range(1, self.num_players + 1):
+            if self.connects_opposite_sides(player_id):
+                return True
+        return False
+
+    def connects_opposite_sides(self, player_id):
+        """Проверяет, соединяет ли игрок две противоположные стороны поля"""
+        connectivity = self.connectivity[player_id]
+
+        # Верх-низ
+        if connectivity.connects('top', 'bottom'):
+            self.find_frontier_lines(player_id)
+            return True
+
+        # Лево-право
+        if connectivity.connects('left', 'right'):
+            self.find_frontier_lines(player_id)
+            return True
+
+        return False
+
+    def find_frontier_lines(self, player_id):
+        """Находит линии передового контура: границу клеток игрока, слитую в прямые отрезки"""
+        own = self.board == player_id
+
+        # Горизонтальная граница на линии y там, где ровно одна из клеток над и под ней - игрока
+        padded = np.zeros((self.board_size + 2, self.board_size), dtype=bool)
+        padded[1:-1] = own
+        horizontal = padded[:-1] != padded[1:]
+
+        # Вертикальная граница - то же самое по столбцам (в транспонированном виде)
+        padded = np.zeros((self.board_size + 2, self.board_size), dtype=bool)
+        padded[1:-1] = own.T
+        vertical = padded[:-1] != padded[1:]
+
+        self.frontier_lines = []
+        for y, x_start, x_end in merge_runs(horizontal):
+            self.frontier_lines.append(((x_start, y), (x_end, y)))
+        for x, y_start, y_end in merge_runs(vertical):
+            self.frontier_lines.append(((x, y_start), (x, y_end)))
+
+    @timed("find_blocked_cells")
+    def find_blocked_cells(self, blocking_player):
+        """Находит клетки, доступ к которым заблокирован"""
+        self.blocked_cells, self.region_labels = blocked_cells(self.board, blocking_player)
+        if self.metrics is not None:
+            self.metrics.count("blocked_cells_labeled", int(np.count_nonzero(self.region_labels >= 0)))
+
+    def handle_premature_endgame(self):
+        """Обрабатывает преждевременный эндгейм"""
+        self.premature_endgame = True
+
+        # Определяем, какой игрок вызвал эндгейм
+        blocking_player = self.current_player + 1
+        if self.recorder is not None:
+            self.recorder.premature_endgame(self.current_player)
+        if self.metrics is not None:
+            self.metrics.count("premature_endgames")
+
+        # Находим заблокированные клетки
+        self.find_blocked_cells(blocking_player)
+
+        # Присваиваем заблокированные клетки блокирующему игроку
+        self.board[self.blocked_cells] = blocking_player
+        if self.blocked_cells.any():
+            self.board_hash ^= int(np.bitwise_xor.reduce(self.zobrist.cells[blocking_player - 1][self.blocked_cells]))
+        self.connectivity[blocking_player].add_cells(zip(*np.nonzero(self.blocked_cells)))
+        self.cell_counts[blocking_player - 1] += int(np.count_nonzero(self.blocked_cells))
+        self.bitboards.add_mask(blocking_player, self.blocked_cells)
+        self.legality.invalidate()
+        self.distance_fields.clear()
+
+        # Завершаем игру
+        self.end_game()
+
+    def end_game(self):
+        """Завершение игры и подсчет очков"""
+        self.game_over = True
+
+        # Подсчет очков: занятые клетки
+        self.player_scores = list(self.cell_counts)
+
+        # Определение победителя
+        max_score = max(self.player_scores)
+        winners = [i for i, score in enumerate(self.player_scores) if score == max_score]
+
+        if len(winners) == 1:
+            self.winner = winners[0]
+        else:
+            self.winner = None  # Ничья
+
+    def bot_move(self):
+        return self.play_bot_move(self.choose_bot_move())
+
+    @timed("bot_move")
+    def choose_bot_move(self, cancelled=None):
+        """Выбирает ход бота, не меняя партию: (x, y, rotation) или None - пропуск.
+
+        cancelled - threading.Event, по которому поисковая стратегия прерывает расчет.
+        """
+        if not self.valid_positions:
+            # Если нет валидных позиций, пропускаем ход
+            return None
+        if self.metrics is not None:
+            self.metrics.count("bot_moves")
+            self.metrics.count("bot_candidates", len(self.valid_positions))
+
+        if self.bot_strategy == "nearest":
+            best_pos = self.find_nearest_position()
+        elif self.bot_strategy == "evaluate":
+            best_pos = self.find_best_position()
+        else:
+            return self.find_search_position(cancelled)
+
+        if not best_pos:
+            # Если не нашли хорошую позицию, ставим в случайное место
+            best_pos = self.rng.choice(self.ordered_positions())
+        return best_pos + (self.rotation,)
+
+    def play_bot_move(self, move):
+        """Делает выбранный ботом ход; возвращает False, если ход пропущен"""
+        if move is None:
+            self.skip_turn()
+            return False
+
+        x, y, rotation = move
+        if rotation != self.rotation:
+            self.rotate()
+        self.place_rect(x, y)
+        return True
+
+    def find_nearest_position(self):
+        """Простая стратегия бота: ставить фигуру как можно ближе к противнику"""
+        ys, xs = np.nonzero(self.valid_mask)
+        if not len(xs):
+            return None
+
+        # Как get_distance_to_opponent: если у противника нет клеток, расстояние 0
+        distances = self.get_distance_field(opponent_of(self.current_player))[ys, xs]
+        distances[np.isinf(distances)] = 0
+        # Из равных - первая по строкам поля, независимо от порядка обхода множества позиций
+        i = int(np.argmin(distances))
+        return int(xs[i]), int(ys[i])
+
+    def find_best_position(self):
+        """Улучшенная стратегия бота: позиция с лучшей оценкой, среди равных - случайная"""
+        if self.first_move[self.current_player]:
+            # На первом ходу единственная позиция - угол
+            return next(iter(self.valid_positions))
+
+        # Оцениваем все возможные позиции сразу
+        xs, ys, scores = self.evaluate_positions(self.valid_mask)
+        if not len(scores) or scores.max() < 0:
+            return None
+
+        best = np.flatnonzero(scores == scores.max())
+        i = best[self.rng.randrange(len(best))]
+        return int(xs[i]), int(ys[i])
+
+    def find_search_position(self, cancelled=None):
+        """Ход (x, y, rotation), выбранный поисковой стратегией"""
+        move = self.bot_strategy.choose_move(self, cancelled)
+        if move is None:
+            # Если не нашли хорошую позицию, ставим в случайное место
+            x, y = self.rng.choice(self.ordered_positions())
+            return x, y, self.rotation
+        return move
+
+    def evaluate_positions(self, mask):
+        """Оценивает все позиции маски сразу, как evaluate_position каждую.
+
+        Возвращает массивы xs, ys и scores одинаковой длины.
+        """
+        ys, xs = np.nonzero(mask)
+        opponent_distance = self.get_distance_field(opponent_of(self.current_player))[ys, xs]
+        scores = position_scores(
+            xs, ys, self.current_rect.width, self.current_rect.height, self.board_size, opponent_distance
+        )
+        return xs, ys, scores
+
+    def evaluate_position(self, x, y):
+        """Оценивает качество позиции для бота"""
+        score = 0
+
+        # Бонус за близость к противнику
+        distance_to_opponent = self.get_distance_to_opponent(x, y)
+        score += max(0, 100 - distance_to_opponent * 2)
+
+        # Бонус за контроль центра
+        center_x, center_y = self.board_size // 2, self.board_size // 2
+        distance_to_center = abs(x - center_x) + abs(y - center_y)
+        score += max(0, 50 - distance_to_center)
+
+        # Бонус за размер фигуры (чем больше, тем лучше)
+        area = self.current_rect.width * self.current_rect.height
+        score += area * 3
+
+        # Штраф за слишком близкое расположение к краям
+        if x < 2 or y < 2 or x + self.current_rect.width > self.board_size - 2 or y + self.current_rect.height > self.board_size - 2:
+            score -= 20
+
+        return score
+
+    def get_distance_field(self, player_id):
+        """Карта расстояний до клеток игрока, считается один раз и дальше обновляется по новым фигурам"""
+        field = self.distance_fields.get(player_id)
+        if field is None:
+            field = distance_field(self.board, player_id)
+            self.distance_fields[player_id] = field
+        return field
+
+    def get_distance_to_opponent(self, x, y):
+        """Вычисляет минимальное расстояние до фигур противника"""
+        # Для многопользовательской игры нужно учитывать всех противников
+        min_dist = self.get_distance_field(opponent_of(self.current_player))[y, x]
+
+        return int(min_dist) if min_dist != float('inf') else 0
+
+
+class BotWorker:
+    """Выбор хода бота в фоновом потоке, чтобы окно продолжало рисоваться.
+
+    Ход передается через очередь и делается в основном потоке (poll -> play_bot_move).
+    cancel прерывает поисковую стратегию, дожидается потока и отбрасывает его ход.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.results = queue.Queue()  # (ход, исключение, время выбора) из фонового потока
+        self.thread = None
+        self.cancelled = None  # threading.Event текущего задания
+        self.ready_at = 0.0
+        self.pending = False  # Ход выбирается или выбран, но еще не сделан
+        self.think_time = 0.0  # Сколько выбирался последний сделанный ход, секунд (без задержки start)
+
+    def start(self, delay=0.0):
+        """Начинает выбирать ход; poll отдаст его не раньше, чем через delay секунд"""
+        self.cancel()
+        self.cancelled = threading.Event()
+        self.ready_at = time.perf_counter() + delay
+        self.pending = True
+        self.thread = threading.Thread(target=self.run, args=(self.cancelled,), daemon=True)
+        self.thread.start()
+
+    def run(self, cancelled):
+        started = time.perf_counter()
+        try:
+            self.results.put((self.engine.choose_bot_move(cancelled), None, time.perf_counter() - started))
+        except Exception as error:  # Передаем в основной поток, иначе партия зависнет
+            self.results.put((None, error, time.perf_counter() - started))
+
+    def poll(self):
+        """(True, ход), если ход выбран и его пора делать, иначе (False, None)"""
+        if not self.pending or time.perf_counter() < self.ready_at:
+            return False, None
+        try:
+            move, error, think_time = self.results.get_nowait()
+        except queue.Empty:
+            return False, None
+        self.pending = False
+        self.think_time = think_time
+        if error is not None:
+            raise error
+        return True, move
+
+    def cancel(self):
+        """Прерывает выбор хода (выход в меню); ход не будет сделан"""
+        if self.thread is not None:
+            self.cancelled.set()
+            self.thread.join()
+            self.thread = None
+        self.pending = False
+        while not self.results.empty():
+            self.results.get_nowait()
\ No newline at end of file
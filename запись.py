@@ -0,0 +1,422 @@
+"""Компактная двоичная запись партий, архивы партий и их воспроизведение без окна.
+
+Партия - заголовок (размер поля, игроки, очередь, seed, версия правил) и записи
+ходов фиксированной длины: ход, пропуск, преждевременный эндгейм и конец партии.
+Архив - партии подряд в одном файле и индекс рядом с ним (путь + ".idx"),
+по которому ход k партии g читается за O(1) через отображение файлов в память.
+
+Снимок - полное состояние идущей партии в одном сжатом .npz: из него партия
+продолжается сразу, без переигрывания с первого хода.
+
+Пример:
+    archive = Archive("games.rbg")
+    board = archive.position(g, k)  # Поле перед ходом k партии g
+"""
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from движок import Bitboards, Engine, LegalityCache, Player, SideConnectivity, blocked_cells
+
+
+MAGIC = b"RBGM"
+FORMAT_VERSION = 1
+RULES_VERSION = 1  # Меняется при изменении правил движка: старые записи играются по старым правилам
+
+# Виды записей
+MOVE, SKIP, PREMATURE_ENDGAME, END = range(4)
+
+# Заголовок партии и запись хода; флаги записи - вид | поворот << 2 | игрок << 4,
+# кубики - первый << 4 | второй
+HEADER = struct.Struct("<4sBBHBBQ")
+HEADER_DTYPE = np.dtype([("magic", "S4"), ("format", "u1"), ("rules", "u1"), ("board_size", "<u2"),
+                         ("players", "u1"), ("queue", "u1"), ("seed", "<u8")])
+RECORD = struct.Struct("<BBHH")
+RECORD_DTYPE = np.dtype([("flags", "u1"), ("dice", "u1"), ("x", "<u2"), ("y", "<u2")])
+# Индекс архива: начало партии в файле и число записей до конца партии
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("records", "<u4")])
+SNAPSHOT_VERSION = 2
+# Числовые поля снимка в массиве meta
+SNAPSHOT_FIELDS = ("snapshot_version", "rules_version", "board_size", "num_players", "max_queue_size",
+                   "current_player", "dice_1", "dice_2", "rotation", "skip_turn_available",
+                   "game_over", "winner", "premature_endgame", "rng_version", "dice_index")
+
+GameHeader = namedtuple("GameHeader", "board_size num_players queue_size seed rules_version")
+Record = namedtuple("Record", "kind player dice rotation x y")
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+class GameWriter:
+    """Потоковая запись одной партии: движок сообщает о каждом ходе через engine.recorder"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.engine = None
+        self.records = 0
+
+    def start(self, engine, seed=None):
+        """Пишет заголовок и подключается к движку; вызывается после engine.start_game().
+
+        seed по умолчанию - seed движка (0, если его нет).
+        """
+        if seed is None:
+            seed = engine.seed or 0
+        self.stream.write(HEADER.pack(MAGIC, FORMAT_VERSION, RULES_VERSION, engine.board_size,
+                                      engine.num_players, engine.max_queue_size, seed))
+        self.engine = engine
+        self.records = 0
+        engine.recorder = self
+
+    def write(self, kind, player, dice=(0, 0), rotation=0, x=0, y=0):
+        self.stream.write(RECORD.pack(kind | rotation << 2 | player << 4, dice[0] << 4 | dice[1], x, y))
+        self.records += 1
+
+    def move(self, player, dice, rect):
+        if rect is None:
+            self.write(SKIP, player, dice)
+            return
+        x, y, w, h = rect
+        # Поворот не хранится в движке после хода - восстанавливается по размерам
+        rotation = 0 if (w, h) == tuple(dice) else 1
+        self.write(MOVE, player, dice, rotation, x, y)
+
+    def premature_endgame(self, player):
+        self.write(PREMATURE_ENDGAME, player)
+
+    def finish(self):
+        """Завершает партию и отключается от движка; возвращает число записей без конца партии"""
+        records = self.records
+        self.write(END, 0)
+        self.stream.flush()
+        if self.engine is not None:
+            self.engine.recorder = None
+            self.engine = None
+        return records
+
+
+class ArchiveWriter:
+    """Дописывает готовые партии (байты GameWriter) в архив и его индекс"""
+
+    def __init__(self, path):
+        if os.path.exists(path) and not os.path.exists(index_path(path)):
+            build_index(path)
+        self.archive = open(path, "ab")
+        self.index = open(index_path(path), "ab")
+        self.offset = self.archive.seek(0, os.SEEK_END)
+
+    def add(self, data):
+        records = (len(data) - HEADER.size) // RECORD.size - 1
+        self.archive.write(data)
+        self.index.write(np.array([(self.offset, records)], dtype=INDEX_DTYPE).tobytes())
+        self.offset += len(data)
+
+    def close(self):
+        self.archive.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_header(data, offset=0):
+    """Заголовок партии из байтов или отображенного в память файла"""
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1, offset=offset)[0]
+    if header["magic"] != MAGIC or header["format"] != FORMAT_VERSION:
+        raise ValueError(f"по смещению {offset} нет записи партии")
+    return GameHeader(int(header["board_size"]), int(header["players"]), int(header["queue"]),
+                      int(header["seed"]), int(header["rules"]))
+
+
+def read_game(data, offset=0):
+    """Заголовок и записи ходов (массив RECORD_DTYPE без конца партии) партии, начинающейся с offset"""
+    header = read_header(data, offset)
+    start = offset + HEADER.size
+    available = (len(data) - start) // RECORD.size
+    # Конец партии ищется в растущем окне, чтобы не просматривать весь архив за ней
+    searched = 0
+    window = 1024
+    while searched < available:
+        count = min(available, searched + window)
+        records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=start)
+        ends = np.flatnonzero(records["flags"][searched:] & 3 == END)
+        if len(ends):
+            return header, records[:searched + ends[0]]
+        searched = count
+        window *= 2
+    raise ValueError(f"партия по смещению {offset} не завершена")
+
+
+def build_index(path):
+    """Строит индекс архива, просматривая партии подряд"""
+    data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else b""
+    entries = []
+    offset = 0
+    while offset < len(data):
+        _, records = read_game(data, offset)
+        entries.append((offset, len(records)))
+        offset += HEADER.size + (len(records) + 1) * RECORD.size
+    np.array(entries, dtype=INDEX_DTYPE).tofile(index_path(path))
+
+
+def decode(record):
+    """Запись хода из массива RECORD_DTYPE в виде Record"""
+    flags, dice = int(record["flags"]), int(record["dice"])
+    return Record(flags & 3, flags >> 4, (dice >> 4, dice & 15), flags >> 2 & 1, int(record["x"]), int(record["y"]))
+
+
+def replay_board(header, records):
+    """Поле после записей ходов: фигуры накладываются срезами, без проверки правил"""
+    board = np.zeros((header.board_size, header.board_size), dtype=np.uint8)
+    flags = records["flags"].tolist()
+    dice = records["dice"].tolist()
+    for flag, pair, x, y in zip(flags, dice, records["x"].tolist(), records["y"].tolist()):
+        kind, player = flag & 3, (flag >> 4) + 1
+        if kind == MOVE:
+            w, h = pair >> 4, pair & 15
+            if flag >> 2 & 1:
+                w, h = h, w
+            board[y:y + h, x:x + w] = player
+        elif kind == PREMATURE_ENDGAME:
+            board[blocked_cells(board, player)[0]] = player
+    return board
+
+
+def replay_engine(header, records):
+    """Движок в позиции после записей ходов; каждый ход проверяется по правилам"""
+    if header.rules_version != RULES_VERSION:
+        raise ValueError(f"запись по правилам версии {header.rules_version}, движок - {RULES_VERSION}")
+    engine = Engine(board_size=header.board_size, num_players=header.num_players,
+                    max_queue_size=header.queue_size)
+    engine.start_game()
+    for record in map(decode, records):
+        if record.kind == PREMATURE_ENDGAME:
+            # Эндгейм объявляется за того, кто отрезал клетки
+            engine.current_player = record.player
+            engine.handle_premature_endgame()
+            continue
+        if record.player != engine.current_player:
+            raise ValueError(f"ход {len(engine.history)}: ходит игрок {engine.current_player + 1}, в записи - {record.player + 1}")
+        # Фигура из записи вместо брошенных кубиков
+        engine.dice_result = record.dice
+        engine.rotation = record.rotation
+        engine.create_current_rect()
+        engine.update_valid_positions()
+        if record.kind == SKIP:
+            engine.skip_turn()
+        elif not engine.place_rect(record.x, record.y):
+            raise ValueError(f"ход {len(engine.history)}: фигуру нельзя поставить в ({record.x}, {record.y})")
+    return engine
+
+
+class Archive:
+    """Архив партий, отображенный в память: партия g и ее ход k без чтения остального файла"""
+
+    def __init__(self, path):
+        size = os.path.getsize(path)
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if size else b""
+        if not self.index_matches(path, size):
+            build_index(path)
+        self.index = (np.memmap(index_path(path), dtype=INDEX_DTYPE, mode="r")
+                      if os.path.getsize(index_path(path)) else np.zeros(0, dtype=INDEX_DTYPE))
+
+    @staticmethod
+    def index_matches(path, size):
+        """Индекс есть и последняя партия в нем кончается вместе с архивом"""
+        if not os.path.exists(index_path(path)):
+            return False
+        index_size = os.path.getsize(index_path(path))
+        if index_size % INDEX_DTYPE.itemsize:
+            return False
+        if not index_size:
+            return size == 0
+        last = np.fromfile(index_path(path), dtype=INDEX_DTYPE, count=1, offset=index_size - INDEX_DTYPE.itemsize)[0]
+        return int(last["offset"]) + HEADER.size + (int(last["records"]) + 1) * RECORD.size == size
+
+    def __len__(self):
+        return len(self.index)
+
+    def header(self, game):
+        return read_header(self.data, int(self.index[game]["offset"]))
+
+    def records(self, game):
+        """Записи ходов партии - массив RECORD_DTYPE прямо поверх файла"""
+        offset, count = int(self.index[game]["offset"]), int(self.index[game]["records"])
+        return np.frombuffer(self.data, dtype=RECORD_DTYPE, count=count, offset=offset + HEADER.size)
+
+    def record(self, game, move):
+        return decode(self.records(game)[move])
+
+    def position(self, game, move=None):
+        """Поле перед ходом move партии game (по умолчанию - в конце партии)"""
+        return replay_board(self.header(game), self.records(game)[:move])
+
+
+def save_snapshot(engine, path, **extra):
+    """Сохраняет состояние партии в сжатый .npz атомарно: файл заменяется только целиком записанным.
+
+    extra - дополнительные значения (например, режим игры окна), read_snapshot вернет их как есть.
+    """
+    num_players = engine.num_players
+    history = np.full((len(engine.history), 7), -1, dtype=np.int16)  # игрок, кубики, x, y, w, h
+    for i, (player, dice, rect) in enumerate(engine.history):
+        history[i, :3] = (player,) + tuple(dice)
+        if rect is not None:
+            history[i, 3:] = rect
+    rng_version, rng_state, gauss = engine.rng.getstate()
+
+    # Системы множеств связности сохраняются как есть - перестраивать их по клеткам дольше.
+    # У незанятых клеток родитель - сама клетка и ранг 0, поэтому хранятся только клетки игрока и стороны
+    parent, rank = [], []
+    for player in range(num_players):
+        connectivity = engine.connectivity[player + 1]
+        nodes = np.append(np.flatnonzero(engine.board == player + 1), np.arange(4) + engine.board.size)
+        parent += [connectivity.parent[node] for node in nodes.tolist()]
+        rank += [connectivity.rank.get(node, 0) for node in nodes.tolist()]
+
+    meta = dict(zip(SNAPSHOT_FIELDS, (
+        SNAPSHOT_VERSION, RULES_VERSION, engine.board_size, num_players, engine.max_queue_size,
+        engine.current_player, *engine.dice_result, engine.rotation, engine.skip_turn_available,
+        engine.game_over, -1 if engine.winner is None else engine.winner, engine.premature_endgame, rng_version,
+        engine.dice_index,
+    )))
+    arrays = dict(
+        extra,
+        meta=np.array([meta[field] for field in SNAPSHOT_FIELDS], dtype=np.int64),
+        board=engine.board,
+        history=history,
+        first_move=np.array([engine.first_move[player] for player in range(num_players)]),
+        piece_queue=np.array(engine.piece_queue, dtype=np.int8).reshape(-1, 2),
+        player_scores=np.array(engine.player_scores),
+        blocked_cells=engine.blocked_cells,
+        valid_mask=engine.valid_mask,
+        frontier_lines=np.array(engine.frontier_lines, dtype=np.int32).reshape(-1, 4),
+        parent=np.array(parent, dtype=np.int32),
+        rank=np.array(rank, dtype=np.uint8),
+        rng_state=np.array(rng_state, dtype=np.uint32),
+        rng_gauss=np.array(np.nan if gauss is None else gauss),
+        dice_stream=np.array([] if engine.dice_stream is None else engine.dice_stream, dtype=np.uint8).reshape(-1, 2),
+    )
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as stream:
+        np.savez_compressed(stream, **arrays)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path):
+    """Массивы снимка по именам (включая дополнительные значения save_snapshot) и поле meta - словарь"""
+    with np.load(path) as data:
+        snapshot = dict(data)
+    snapshot["meta"] = dict(zip(SNAPSHOT_FIELDS, snapshot["meta"].tolist()))
+    meta = snapshot["meta"]
+    if meta["snapshot_version"] != SNAPSHOT_VERSION or meta["rules_version"] != RULES_VERSION:
+        raise ValueError(f"снимок версии {meta['snapshot_version']} по правилам версии {meta['rules_version']} не поддерживается")
+    # Массивы должны сходиться с meta: иначе restore_snapshot упадет посреди восстановления или партия - позже
+    size, num_players = meta["board_size"], meta["num_players"]
+    board = snapshot["board"]
+    if not 2 <= num_players <= 4 or board.shape != (size, size) or board.max(initial=0) > num_players:
+        raise ValueError("доска снимка не совпадает с его размером и числом игроков")
+    if not 0 <= meta["current_player"] < num_players or len(snapshot["first_move"]) != num_players:
+        raise ValueError("игроки снимка не совпадают с их числом")
+    nodes = np.count_nonzero(board) + 4 * num_players
+    if len(snapshot["parent"]) != nodes or len(snapshot["rank"]) != nodes:
+        raise ValueError("связность снимка не совпадает с доской")
+    return snapshot
+
+
+def restore_snapshot(engine, snapshot):
+    """Переводит движок в позицию снимка; производные структуры (маски, битборды, хеш) строятся
+    сразу по массивам снимка, без start_game и пустой доски"""
+    meta = snapshot["meta"]
+    engine.board_size, engine.num_players, engine.max_queue_size = meta["board_size"], meta["num_players"], meta["max_queue_size"]
+    num_players = engine.num_players
+    board = np.array(snapshot["board"], dtype=np.uint8)
+    engine.board = board
+    engine.legality = LegalityCache(board, engine.metrics)  # Маски считаются лениво - только для нужных форм
+    engine.bitboards = Bitboards(engine.board_size, num_players)
+    engine.distance_fields = {}
+    engine.connectivity = {player + 1: SideConnectivity(engine.board_size, engine.metrics) for player in range(num_players)}
+    engine.prepare_zobrist()
+    engine.players = [Player(player) for player in range(num_players)]
+    engine.valid_positions = set()
+    engine.valid_mask = None
+    engine.region_labels = None
+    engine.last_move = None
+
+    # Ходы партии
+    history = snapshot["history"]
+    engine.history = [(player, (dice_1, dice_2), None if w < 0 else (x, y, w, h))
+                      for player, dice_1, dice_2, x, y, w, h in history.tolist()]
+    placed = history[history[:, 5] >= 0]
+    engine.placed_rects = {player: list(map(tuple, placed[placed[:, 0] == player, 3:].tolist()))
+                           for player in range(num_players)}
+    if len(placed):
+        engine.last_move = tuple(placed[-1, 3:].tolist())
+
+    engine.current_player = meta["current_player"]
+    engine.dice_result = (meta["dice_1"], meta["dice_2"])
+    engine.rotation = meta["rotation"]
+    engine.piece_queue = [tuple(dice) for dice in snapshot["piece_queue"].tolist()]
+    engine.first_move = dict(enumerate(snapshot["first_move"].tolist()))
+    engine.skip_turn_available = bool(meta["skip_turn_available"])
+    engine.game_over = bool(meta["game_over"])
+    engine.winner = None if meta["winner"] < 0 else meta["winner"]
+    engine.premature_endgame = bool(meta["premature_endgame"])
+    engine.player_scores = snapshot["player_scores"].tolist()
+    engine.blocked_cells = snapshot["blocked_cells"]
+    engine.frontier_lines = [((x1, y1), (x2, y2)) for x1, y1, x2, y2 in snapshot["frontier_lines"].tolist()]
+
+    # Клетки игроков: счетчики, битборды, связность и ключ Зобриста
+    engine.cell_counts = []
+    start = 0
+    for player in range(num_players):
+        own = board == player + 1
+        engine.bitboards.add_mask(player + 1, own)
+
+        connectivity = engine.connectivity[player + 1]
+        cells = np.flatnonzero(own)
+        engine.cell_counts.append(len(cells))
+        nodes = np.append(cells, np.arange(4) + board.size).tolist()
+        stop = start + len(nodes)
+        rank = snapshot["rank"][start:stop]
+        parents = snapshot["parent"][start:stop]
+        # Родитель - клетка того же игрока или одна из сторон поля
+        if (len(parents) and (parents.min() < 0 or parents.max() >= board.size + 4)
+                or (board.ravel()[parents[parents < board.size]] != player + 1).any()):
+            raise ValueError(f"связность игрока {player + 1} в снимке ссылается на чужие клетки")
+        connectivity.parent = dict(zip(nodes, parents.tolist()))
+        connectivity.rank = {nodes[i]: r for i, r in zip(np.flatnonzero(rank).tolist(), rank[rank > 0].tolist())}
+        start = stop
+    engine.board_hash = engine.zobrist.board(board, engine.first_move)
+
+    gauss = float(snapshot["rng_gauss"])
+    engine.rng.setstate((meta["rng_version"], tuple(snapshot["rng_state"].tolist()), None if np.isnan(gauss) else gauss))
+    engine.dice_stream = snapshot["dice_stream"] if len(snapshot["dice_stream"]) else None
+    engine.dice_index = meta["dice_index"]
+
+    engine.create_current_rect()
+    # Маска допустимых позиций текущей фигуры сохранена в снимке - полный пересчет на большом поле долгий
+    valid_mask = snapshot.get("valid_mask")  # В ранних снимках версии 2 ее нет
+    width, height = engine.current_rect.width, engine.current_rect.height
+    shape = (engine.board_size - height + 1, engine.board_size - width + 1)
+    if (valid_mask is not None and valid_mask.shape == shape
+            and not engine.game_over and not engine.first_move[engine.current_player]):
+        engine.legality.restore(engine.current_player + 1, width, height, valid_mask.copy())
+    engine.update_valid_positions()
+
+
+def load_snapshot(engine, path):
+    """Продолжает в движке партию из снимка; возвращает массивы снимка"""
+    snapshot = read_snapshot(path)
+    restore_snapshot(engine, snapshot)
+    return snapshot
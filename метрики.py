@@ -0,0 +1,130 @@
+"""Счетчики работы движка и гистограммы времени операций для долгих сессий без профилировщика.
+
+Движок считает, только если ему дали объект Metrics (engine.metrics = Metrics(...)):
+без него каждая замеряемая операция стоит одну проверку на None.
+Память не растет со временем: счетчик - одно число, гистограмма - фиксированные корзины.
+
+Итоги периодически (не чаще раза в interval секунд) пишутся в файл:
+- *.csv - дописываются строки time,metric,operation,le,value с накопленными значениями;
+- иначе - текстовый формат Prometheus (для node_exporter textfile), файл заменяется целиком.
+
+Пример:
+    engine.metrics = Metrics("metrics.prom", interval=60)
+    ...
+    engine.metrics.flush()
+"""
+import csv
+import os
+import time
+from bisect import bisect_left
+
+# Верхние границы корзин гистограмм времени, секунд
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "rect_battles_"  # Префикс имен метрик Prometheus
+
+# Счетчики движка и их описания
+COUNTERS = {
+    "moves": "поставленные фигуры",
+    "skips": "пропущенные ходы",
+    "premature_endgames": "преждевременные эндгеймы",
+    "bot_moves": "выборы хода ботом",
+    "bot_candidates": "позиции, из которых выбирал бот",
+    "legality_cells": "позиции, пересчитанные в масках допустимых ходов",
+    "connectivity_unions": "объединения в связности игроков со сторонами поля",
+    "blocked_cells_labeled": "клетки, размеченные при поиске заблокированных",
+}
+
+
+class Metrics:
+    """Накопленные счетчики и гистограммы времени операций"""
+
+    def __init__(self, path=None, interval=60.0, buckets=LATENCY_BUCKETS):
+        self.path = path  # None - только в памяти (например, в процессе симуляции)
+        self.interval = interval
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}  # операция -> число значений в каждой корзине и сверх последней
+        self.sums = {}  # операция -> сумма значений, секунд
+        self.flushed_at = time.monotonic()
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, operation, seconds):
+        counts = self.histograms.get(operation)
+        if counts is None:
+            counts = self.histograms[operation] = [0] * (len(self.buckets) + 1)
+            self.sums[operation] = 0.0
+        counts[bisect_left(self.buckets, seconds)] += 1
+        self.sums[operation] += seconds
+
+    def merge(self, other):
+        """Добавляет счетчики и гистограммы другого Metrics с теми же корзинами"""
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for operation, counts in other.histograms.items():
+            mine = self.histograms.setdefault(operation, [0] * (len(self.buckets) + 1))
+            for i, value in enumerate(counts):
+                mine[i] += value
+            self.sums[operation] = self.sums.get(operation, 0.0) + other.sums[operation]
+
+    def samples(self):
+        """Накопленные значения: (метрика, операция, граница корзины, значение); корзины нарастающим итогом"""
+        for name in sorted(self.counters):
+            yield f"{name}_total", "", "", self.counters[name]
+        for operation in sorted(self.histograms):
+            total = 0
+            for bound, value in zip(self.buckets + ("+Inf",), self.histograms[operation]):
+                total += value
+                yield "operation_seconds_bucket", operation, str(bound), total
+            yield "operation_seconds_sum", operation, "", self.sums[operation]
+            yield "operation_seconds_count", operation, "", total
+
+    def tick(self):
+        """Пишет итоги, если с прошлой записи прошло interval секунд"""
+        if self.path is not None and time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.path is None:
+            return
+        if self.path.endswith(".csv"):
+            self.write_csv(self.path)
+        else:
+            self.write_prometheus(self.path)
+        self.flushed_at = time.monotonic()
+
+    def write_csv(self, path):
+        new = not os.path.exists(path)
+        now = round(time.time(), 3)
+        with open(path, "a", newline="", encoding="utf-8") as stream:
+            writer = csv.writer(stream)
+            if new:
+                writer.writerow(["time", "metric", "operation", "le", "value"])
+            writer.writerows((now,) + sample for sample in self.samples())
+
+    def write_prometheus(self, path):
+        """Текстовый формат Prometheus; файл заменяется атомарно, чтобы сборщик не прочитал его наполовину"""
+        lines = []
+        described = set()
+        for metric, operation, bound, value in self.samples():
+            family = metric[:-len("_total")] if metric.endswith("_total") else metric.rsplit("_", 1)[0]
+            if family not in described:
+                described.add(family)
+                if metric.endswith("_total"):
+                    lines.append(f"# HELP {PREFIX}{metric} {COUNTERS.get(family, family)}")
+                    lines.append(f"# TYPE {PREFIX}{metric} counter")
+                else:
+                    lines.append(f"# HELP {PREFIX}{family} время операций движка, секунд")
+                    lines.append(f"# TYPE {PREFIX}{family} histogram")
+            labels = []
+            if operation:
+                labels.append(f'operation="{operation}"')
+            if bound:
+                labels.append(f'le="{bound}"')
+            lines.append(f"{PREFIX}{metric}{'{' + ','.join(labels) + '}' if labels else ''} {value}")
+
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as stream:
+            stream.write("\n".join(lines) + "\n")
+        os.replace(temporary, path)
@@ -0,0 +1,472 @@
+"""Поисковые боты с бюджетом времени на ход: Монте-Карло по дереву (MCTS) и expectimax."""
+import math
+import multiprocessing
+import random
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from движок import corner_position, distance_field, legal_mask, opponent_of, position_scores
+
+# Различные броски с учетом поворота фигуры: (a, b) при a <= b и их вероятности
+DICE_OUTCOMES = [((a, b), (1 if a == b else 2) / 36) for a in range(1, 7) for b in range(a, 7)]
+
+
+class SearchState:
+    """Облегченное состояние партии для поиска: доска, очередь хода и известные фигуры"""
+
+    __slots__ = ("board", "num_players", "player", "first_move", "cells", "dice", "queue", "rng")
+
+    def __init__(self, board, num_players, player, first_move, cells, dice, queue, rng):
+        self.board = board
+        self.num_players = num_players
+        self.player = player
+        self.first_move = first_move
+        self.cells = cells  # Клетки каждого игрока
+        self.dice = dice
+        self.queue = queue  # Известные следующие фигуры (из piece_queue)
+        self.rng = rng
+
+    @classmethod
+    def from_engine(cls, engine, rng):
+        first_move = [engine.first_move[i] for i in range(engine.num_players)]
+        return cls(engine.board.copy(), engine.num_players, engine.current_player,
+                   first_move, list(engine.cell_counts), engine.dice_result, list(engine.piece_queue), rng)
+
+    def copy(self):
+        return SearchState(self.board.copy(), self.num_players, self.player,
+                           list(self.first_move), list(self.cells), self.dice, list(self.queue), self.rng)
+
+    def shapes(self):
+        """Размеры фигуры в обоих поворотах: [(rotation, w, h), ...]"""
+        w, h = self.dice
+        if w == h:
+            return [(0, w, h)]
+        return [(0, w, h), (1, h, w)]
+
+    def moves(self, limit):
+        """До limit лучших по эвристике ходов (x, y, rotation); [None], если остается только пропуск"""
+        size = self.board.shape[0]
+        if self.first_move[self.player]:
+            w, h = self.dice
+            x, y = corner_position(size, self.num_players, self.player, w, h)
+            # Угол мог занять другой игрок - тогда остается только пропуск
+            return [None] if self.board[y:y + h, x:x + w].any() else [(x, y, 0)]
+
+        opponent = distance_field(self.board, opponent_of(self.player))
+        candidates = []
+        for rotation, w, h in self.shapes():
+            ys, xs = np.nonzero(legal_mask(self.board, w, h, self.player + 1))
+            if not len(xs):
+                continue
+            scores = position_scores(xs, ys, w, h, size, opponent[ys, xs])
+            for i in np.argsort(-scores, kind="stable")[:limit]:
+                candidates.append((scores[i], int(xs[i]), int(ys[i]), rotation))
+
+        if not candidates:
+            return [None]
+        candidates.sort(key=lambda c: -c[0])
+        return [(x, y, rotation) for _, x, y, rotation in candidates[:limit]]
+
+    def random_move(self):
+        """Случайный допустимый ход (или None, если ходить некуда)"""
+        if self.first_move[self.player]:
+            return self.moves(1)[0]
+        shapes = self.shapes()
+        self.rng.shuffle(shapes)
+        for rotation, w, h in shapes:
+            ys, xs = np.nonzero(legal_mask(self.board, w, h, self.player + 1))
+            if len(xs):
+                i = self.rng.randrange(len(xs))
+                return int(xs[i]), int(ys[i]), rotation
+        return None
+
+    def play(self, move):
+        """Делает ход (None - пропуск) и бросает кубики следующему игроку"""
+        if move is not None:
+            x, y, rotation = move
+            w, h = self.dice if rotation == 0 else self.dice[::-1]
+            self.board[y:y + h, x:x + w] = self.player + 1
+            self.cells[self.player] += w * h
+            self.first_move[self.player] = False
+        self.player = (self.player + 1) % self.num_players
+        if self.queue:
+            self.dice = self.queue.pop(0)
+        else:
+            self.dice = (self.rng.randint(1, 6), self.rng.randint(1, 6))
+
+    def rewards(self):
+        """Доля каждого игрока в сумме (клетки + места для новых фигур)"""
+        values = []
+        for player in range(self.num_players):
+            cells = self.cells[player]
+            if self.first_move[player]:
+                mobility = 1
+            else:
+                mobility = np.count_nonzero(legal_mask(self.board, 1, 1, player + 1))
+            values.append(float(cells + mobility))
+        total = sum(values) or 1.0
+        return [value / total for value in values]
+
+
+def rollout(task):
+    """Случайное доигрывание на depth ходов; выполняется и в процессах пула"""
+    board, num_players, player, first_move, cells, dice, queue, depth, seed = task
+    state = SearchState(board, num_players, player, first_move, cells, dice, queue, random.Random(seed))
+    for _ in range(depth):
+        state.play(state.random_move())
+    return state.rewards()
+
+
+class Node:
+    """Узел выбора хода: у каждого хода своя статистика и исходы следующего броска"""
+
+    __slots__ = ("player", "untried", "children", "visits")
+
+    def __init__(self, state, limit):
+        self.player = state.player
+        self.untried = state.moves(limit)[::-1]  # Лучшие по эвристике пробуем первыми
+        self.children = {}
+        self.visits = 0
+
+
+class Edge:
+    __slots__ = ("visits", "totals", "outcomes")
+
+    def __init__(self, num_players):
+        self.visits = 0
+        self.totals = [0.0] * num_players
+        self.outcomes = {}  # Кубики следующего игрока -> Node
+
+
+class MCTSBot:
+    """Бот на основе MCTS со случайными кубиками в доигрываниях.
+
+    Ход выбирается за time_limit секунд или iterations итераций (что наступит раньше).
+    Доигрывания при workers > 0 считаются пачками в пуле процессов, а поддерево
+    выбранного хода переиспользуется на следующем ходу.
+    """
+
+    def __init__(self, time_limit=0.4, iterations=None, workers=0, candidates=8,
+                 rollout_depth=6, exploration=0.7, seed=None):
+        self.time_limit = time_limit
+        self.iterations = iterations
+        self.workers = workers
+        self.candidates = candidates
+        self.rollout_depth = rollout_depth
+        self.exploration = exploration
+        self.rng = random.Random(seed)
+        self.pool = None
+        self.root = None
+        self.history_size = 0  # Длина истории партии в момент прошлого хода
+        self.last_move = None
+        self.last_edge = None
+        self.last_iterations = 0
+
+    def reset(self):
+        """Забывает дерево (новая партия)"""
+        self.root = None
+        self.last_edge = None
+        self.history_size = 0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def start_pool(self):
+        """Запускает процессы пула заранее, чтобы не тратить на это время хода"""
+        if self.workers and self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+
+    def choose_move(self, engine, cancelled=None):
+        deadline = time.perf_counter() + self.time_limit if self.time_limit else None
+        state = SearchState.from_engine(engine, self.rng)
+        root = self.reuse_subtree(engine)
+        if root is None:
+            root = Node(state, self.candidates)
+        if len(root.untried) + len(root.children) == 1:
+            # Выбирать не из чего (первый ход или единственная позиция)
+            move = root.untried[-1] if root.untried else next(iter(root.children))
+            self.root = None
+            self.last_edge = None
+            return move
+        self.start_pool()
+
+        batch = self.workers or 1
+        iterations = 0
+        while True:
+            if self.iterations is not None and iterations >= self.iterations:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if cancelled is not None and cancelled.is_set():
+                break
+            self.run_batch(root, state, batch)
+            iterations += batch
+        self.last_iterations = iterations
+
+        if root.children:
+            move, edge = max(root.children.items(), key=lambda item: item[1].visits)
+        else:
+            # Времени не хватило ни на одну итерацию - лучший ход по эвристике
+            move, edge = root.untried[-1], None
+
+        self.root = root
+        self.last_move = move
+        self.last_edge = edge
+        self.history_size = len(engine.history)
+        return move
+
+    def reuse_subtree(self, engine):
+        """Находит в старом дереве узел текущей позиции по ходам, сделанным с прошлого раза"""
+        if self.last_edge is None or self.last_move is None:
+            return None
+        history = engine.history[self.history_size:]
+        if not history:
+            return None
+
+        # Первым в истории должен быть наш собственный прошлый ход
+        edge = None
+        node = self.root
+        for player, dice, rect in history:
+            if rect is None:
+                move = None
+            else:
+                x, y, w, h = rect
+                move = (x, y, 0 if (w, h) == tuple(dice) else 1)
+            if edge is not None:
+                node = edge.outcomes.get(tuple(dice))
+            if node is None or node.player != player:
+                return None
+            edge = node.children.get(move)
+            if edge is None:
+                return None
+
+        node = edge.outcomes.get(tuple(engine.dice_result))
+        if node is None or node.player != engine.current_player:
+            return None
+        return node
+
+    def run_batch(self, root, state, batch):
+        """Выбирает batch листьев (с виртуальными потерями), доигрывает их и обновляет статистику"""
+        paths = []
+        tasks = []
+        for _ in range(batch):
+            path, leaf = self.select(root, state.copy())
+            for edge in path:
+                edge.visits += 1  # Виртуальная потеря, чтобы в пачке листья различались
+            paths.append(path)
+            tasks.append((leaf.board, leaf.num_players, leaf.player, leaf.first_move, leaf.cells, leaf.dice,
+                          leaf.queue, self.rollout_depth, self.rng.getrandbits(32)))
+
+        if self.pool is not None:
+            results = self.pool.map(rollout, tasks)
+        else:
+            results = [rollout(task) for task in tasks]
+
+        for path, rewards in zip(paths, results):
+            root.visits += 1
+            for edge in path:
+                for i, reward in enumerate(rewards):
+                    edge.totals[i] += reward
+
+    def select(self, node, state):
+        """Спуск по дереву до нового узла; state изменяется по пути"""
+        path = []
+        while True:
+            if node.untried:
+                move = node.untried.pop()
+                edge = Edge(state.num_players)
+                node.children[move] = edge
+                state.play(move)
+                path.append(edge)
+                return path, state
+
+            move, edge = self.best_child(node)
+            state.play(move)
+            path.append(edge)
+
+            dice = state.dice
+            child = edge.outcomes.get(dice)
+            if child is None:
+                edge.outcomes[dice] = Node(state, self.candidates)
+                return path, state
+            node = child
+            node.visits += 1
+
+    def best_child(self, node):
+        """UCB1 с точки зрения игрока, который ходит в узле"""
+        log_visits = math.log(max(node.visits, 1))
+        best = None
+        best_value = -math.inf
+        for move, edge in node.children.items():
+            if edge.visits == 0:
+                return move, edge
+            value = (edge.totals[node.player] / edge.visits
+                     + self.exploration * math.sqrt(log_visits / edge.visits))
+            if value > best_value:
+                best_value = value
+                best = (move, edge)
+        return best
+
+
+class SearchTimeout(Exception):
+    """Время на ход вышло (или ход отменен) посреди очередной глубины поиска"""
+
+
+class TranspositionTable:
+    """Уже оцененные позиции по ключу Зобриста; давно не использованные вытесняются (LRU)"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ExpectimaxBot:
+    """Поиск с ожиданием по кубикам (expectimax, для 3-4 игроков - max-n).
+
+    Текущая фигура и фигуры из piece_queue известны и дают детерминированные ходы,
+    после них узлы случайности перебирают 21 различный бросок. Глубина растет
+    итеративно, пока не выйдет time_limit (или до max_depth), а оцененные позиции
+    берутся из таблицы транспозиций по ключу Зобриста, который ведет движок
+    и который поиск обновляет при ходе и откате без пересчета всей доски.
+    """
+
+    def __init__(self, time_limit=0.4, max_depth=8, candidates=6, table_size=200000):
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.candidates = candidates
+        self.table = TranspositionTable(table_size)
+        self.zobrist = None
+        self.deadline = None
+        self.cancelled = None  # threading.Event отмены текущего хода
+        self.last_depth = 0  # Глубина, полностью просчитанная на прошлом ходу
+        self.nodes = 0
+
+    def reset(self):
+        """Забывает таблицу транспозиций (новая партия)"""
+        self.table.clear()
+
+    def choose_move(self, engine, cancelled=None):
+        self.deadline = time.perf_counter() + self.time_limit if self.time_limit else None
+        self.cancelled = cancelled
+        state = SearchState.from_engine(engine, None)
+        if self.zobrist is not engine.zobrist:
+            # Ключи от другой партии или другого поля - старые записи не годятся
+            self.zobrist = engine.zobrist
+            self.table.clear()
+        board_key = engine.board_hash
+
+        best = None
+        self.last_depth = 0
+        self.nodes = 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                _, move = self.decide(state, board_key, depth)
+            except SearchTimeout:
+                break
+            best = move
+            self.last_depth = depth
+
+        if best is None:
+            # Не успели даже глубину 1 - лучший ход по эвристике
+            best = state.moves(1)[0]
+        return best
+
+    def decide(self, state, board_key, depth):
+        """Узел хода: игрок выбирает ход, лучший для себя. Возвращает (оценки игроков, ход)"""
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise SearchTimeout()
+        self.nodes += 1
+
+        key = board_key ^ self.zobrist.turn[state.player] ^ self.zobrist.sequence([state.dice] + state.queue)
+        entry = self.table.get(key)
+        if entry is not None and entry[0] >= depth:
+            return entry[1], entry[2]
+
+        if depth == 0:
+            values, best_move = state.rewards(), None
+        else:
+            player = state.player
+            values = best_move = None
+            for move in state.moves(self.candidates):
+                undo, delta = self.apply(state, move)
+                move_values = self.chance(state, board_key ^ delta, depth - 1)
+                self.undo(state, move, undo)
+                if values is None or move_values[player] > values[player]:
+                    values, best_move = move_values, move
+
+        self.table.put(key, (depth, values, best_move))
+        return values, best_move
+
+    def chance(self, state, board_key, depth):
+        """Бросок следующего игрока: известен из очереди или усредняется по всем исходам"""
+        if depth == 0:
+            return self.decide(state, board_key, 0)[0]
+
+        dice = state.dice
+        if state.queue:
+            state.dice = state.queue.pop(0)
+            values = self.decide(state, board_key, depth)[0]
+            state.queue.insert(0, state.dice)
+            state.dice = dice
+            return values
+
+        total = [0.0] * state.num_players
+        for outcome, probability in DICE_OUTCOMES:
+            state.dice = outcome
+            values = self.decide(state, board_key, depth)[0]
+            for i, value in enumerate(values):
+                total[i] += probability * value
+        state.dice = dice
+        return total
+
+    def apply(self, state, move):
+        """Делает ход в state; возвращает данные для отката и изменение ключа доски"""
+        player = state.player
+        first = state.first_move[player]
+        delta = 0
+        if move is not None:
+            x, y, rotation = move
+            w, h = state.dice if rotation == 0 else state.dice[::-1]
+            state.board[y:y + h, x:x + w] = player + 1
+            state.cells[player] += w * h
+            delta ^= self.zobrist.rect(player + 1, x, y, w, h)
+            if first:
+                state.first_move[player] = False
+                delta ^= self.zobrist.first[player]
+        state.player = (player + 1) % state.num_players
+        return (player, state.dice, first), delta
+
+    def undo(self, state, move, undo):
+        player, dice, first = undo
+        if move is not None:
+            x, y, rotation = move
+            w, h = dice if rotation == 0 else dice[::-1]
+            state.board[y:y + h, x:x + w] = 0
+            state.cells[player] -= w * h
+        state.first_move[player] = first
+        state.player = player
+        state.dice = dice
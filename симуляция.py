@@ -0,0 +1,247 @@
+"""Массовая симуляция партий бот против бота без окна.
+
+Пример:
+    python симуляция.py --games 10000 --size 100 --players 2 --strategy nearest,evaluate --output games.csv
+
+С --record games.rbg ходы всех партий дописываются в архив (см. запись.py),
+с --start snapshot.npz все партии продолжаются из сохраненной позиции,
+с --metrics metrics.prom (или .csv) счетчики и время операций движка всех партий пишутся в файл.
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import sys
+import time
+
+from движок import Engine, dice_stream
+from поиск import ExpectimaxBot, MCTSBot
+from запись import ArchiveWriter, GameWriter, load_snapshot, read_snapshot
+from метрики import Metrics
+
+
+def play_game(task):
+    """Играет одну партию до конца и возвращает ее итоги"""
+    seed, board_size, num_players, strategies, max_turns, mcts_iterations, expectimax_depth, record, start, metrics = task
+
+    # Поисковые боты свои у каждого игрока, доигрывания внутри процесса симуляции
+    bots = []
+    for name in strategies:
+        if name == "mcts":
+            bots.append(MCTSBot(time_limit=None, iterations=mcts_iterations, seed=seed))
+        elif name == "expectimax":
+            bots.append(ExpectimaxBot(time_limit=None, max_depth=expectimax_depth))
+        else:
+            bots.append(name)
+
+    # Партия определяется своим seed: броски кубиков выдаются заранее одним массивом,
+    # генератор движка нужен только боту для выбора среди равных позиций
+    engine = Engine(board_size=board_size, num_players=num_players, seed=seed)
+    dice = dice_stream(seed, max_turns + engine.max_queue_size + 1)
+    if start is None:
+        engine.use_dice_stream(dice)
+        engine.start_game()
+    else:
+        # Снимок восстанавливает генератор и кубики сохраненной партии - дальше у каждой партии свои
+        load_snapshot(engine, start)
+        engine.rng.seed(seed)
+        engine.use_dice_stream(dice)
+    if record:
+        # Запись копится в памяти процесса и уходит в архив вместе с итогами
+        recorder = GameWriter(io.BytesIO())
+        recorder.start(engine, seed)
+    if metrics:
+        # Метрики партии уходят вместе с итогами и складываются в основном процессе
+        engine.metrics = Metrics()
+
+    moves = 0
+    skips = 0
+    idle = 0  # Пропусков подряд
+    move_time = 0.0
+    started = time.perf_counter()
+
+    for turn in range(max_turns):
+        engine.bot_strategy = bots[engine.current_player % len(bots)]
+
+        move_started = time.perf_counter()
+        placed = engine.bot_move()
+        move_time += time.perf_counter() - move_started
+
+        if placed:
+            moves += 1
+            idle = 0
+        else:
+            skips += 1
+            idle += 1
+            # Все подряд пропустили - проверяем, может ли кто-нибудь еще ходить
+            if idle >= num_players and not any(engine.has_any_move(p) for p in range(num_players)):
+                break
+
+    engine.end_game()
+
+    result = {
+        "seed": seed,
+        "board_size": board_size,
+        "players": num_players,
+        "strategies": ",".join(strategies),
+        "winner": -1 if engine.winner is None else engine.winner,
+        "scores": [int(score) for score in engine.player_scores],
+        "turns": moves + skips,
+        "moves": moves,
+        "skips": skips,
+        "duration": time.perf_counter() - started,
+        "ms_per_move": move_time * 1000 / max(moves + skips, 1),
+    }
+    if record:
+        recorder.finish()
+        result["record"] = recorder.stream.getvalue()
+    if metrics:
+        result["metrics"] = engine.metrics
+    return result
+
+
+class ResultWriter:
+    """Построчная запись итогов партий в CSV или JSONL по мере их завершения"""
+
+    def __init__(self, stream, fmt, num_players):
+        self.stream = stream
+        self.fmt = fmt
+        self.writer = None
+        if fmt == "csv":
+            fields = ["seed", "board_size", "players", "strategies", "winner"]
+            fields += [f"score_{i + 1}" for i in range(num_players)]
+            fields += ["turns", "moves", "skips", "duration", "ms_per_move"]
+            self.writer = csv.DictWriter(stream, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.fmt == "csv":
+            row = dict(result)
+            for i, score in enumerate(row.pop("scores")):
+                row[f"score_{i + 1}"] = score
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(result) + "\n")
+        self.stream.flush()
+
+
+class Summary:
+    """Сводка по сыгранным партиям: доли побед, очки, длина партий, время хода"""
+
+    def __init__(self, num_players):
+        self.games = 0
+        self.wins = [0] * num_players
+        self.draws = 0
+        self.score_totals = [0] * num_players
+        self.score_min = [None] * num_players
+        self.score_max = [None] * num_players
+        self.turns = 0
+        self.ms_per_move = 0.0
+
+    def add(self, result):
+        self.games += 1
+        if result["winner"] < 0:
+            self.draws += 1
+        else:
+            self.wins[result["winner"]] += 1
+        for i, score in enumerate(result["scores"]):
+            self.score_totals[i] += score
+            self.score_min[i] = score if self.score_min[i] is None else min(self.score_min[i], score)
+            self.score_max[i] = score if self.score_max[i] is None else max(self.score_max[i], score)
+        self.turns += result["turns"]
+        self.ms_per_move += result["ms_per_move"]
+
+    def report(self, stream):
+        if not self.games:
+            print("Нет сыгранных партий", file=stream)
+            return
+        print(f"Партий: {self.games}, ничьих: {self.draws / self.games:.1%}", file=stream)
+        for i in range(len(self.wins)):
+            print(f"Игрок {i + 1}: побед {self.wins[i] / self.games:.1%}, "
+                  f"очки {self.score_totals[i] / self.games:.1f} "
+                  f"(от {self.score_min[i]} до {self.score_max[i]})", file=stream)
+        print(f"Средняя длина партии: {self.turns / self.games:.1f} ходов", file=stream)
+        print(f"Среднее время хода: {self.ms_per_move / self.games:.2f} мс", file=stream)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Симуляция партий бот против бота")
+    parser.add_argument("--games", type=int, default=100, help="количество партий")
+    parser.add_argument("--seed", type=int, default=0, help="первый seed (партии получают seed, seed+1, ...)")
+    parser.add_argument("--size", type=int, default=50, help="размер поля")
+    parser.add_argument("--players", type=int, default=2, choices=[2, 3, 4], help="количество игроков")
+    parser.add_argument("--strategy", default="evaluate",
+                        help="стратегии ботов через запятую по порядку игроков: nearest, evaluate, mcts, expectimax")
+    parser.add_argument("--mcts-iterations", type=int, default=100, help="итераций MCTS на ход")
+    parser.add_argument("--expectimax-depth", type=int, default=2, help="глубина expectimax в ходах")
+    parser.add_argument("--max-turns", type=int, default=None, help="предел ходов в партии")
+    parser.add_argument("--workers", type=int, default=None, help="количество процессов (по умолчанию все ядра)")
+    parser.add_argument("--output", default="-", help="файл для итогов (по умолчанию stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                        help="формат итогов (по умолчанию по расширению файла, иначе csv)")
+    parser.add_argument("--record", default=None, help="архив для записи ходов партий (дописывается)")
+    parser.add_argument("--start", default=None, help="снимок позиции, из которой продолжаются все партии")
+    parser.add_argument("--metrics", default=None,
+                        help="файл для счетчиков и времени операций движка (*.csv или текстовый формат Prometheus)")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="как часто обновлять файл метрик, секунд")
+    args = parser.parse_args(argv)
+
+    if args.start is not None:
+        if args.record is not None:
+            parser.error("--record записывает партии с первого хода, с --start его использовать нельзя")
+        # Размер поля и число игроков задает снимок
+        meta = read_snapshot(args.start)["meta"]
+        args.size, args.players = meta["board_size"], meta["num_players"]
+
+    args.strategies = args.strategy.split(",")
+    for strategy in args.strategies:
+        if strategy not in ("nearest", "evaluate", "mcts", "expectimax"):
+            parser.error(f"неизвестная стратегия: {strategy}")
+    if args.max_turns is None:
+        # Каждая фигура занимает хотя бы одну клетку
+        args.max_turns = args.size * args.size * 2
+    if args.format is None:
+        args.format = "jsonl" if args.output.endswith(".jsonl") else "csv"
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tasks = [
+        (seed, args.size, args.players, args.strategies, args.max_turns, args.mcts_iterations, args.expectimax_depth,
+         args.record is not None, args.start, args.metrics is not None)
+        for seed in range(args.seed, args.seed + args.games)
+    ]
+
+    stream = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    writer = ResultWriter(stream, args.format, args.players)
+    summary = Summary(args.players)
+    archive = None if args.record is None else ArchiveWriter(args.record)
+    metrics = None if args.metrics is None else Metrics(args.metrics, args.metrics_interval)
+    started = time.perf_counter()
+
+    try:
+        with multiprocessing.Pool(args.workers) as pool:
+            for result in pool.imap_unordered(play_game, tasks):
+                if archive is not None:
+                    archive.add(result.pop("record"))
+                if metrics is not None:
+                    metrics.merge(result.pop("metrics"))
+                    metrics.tick()
+                writer.write(result)
+                summary.add(result)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+        if archive is not None:
+            archive.close()
+        if metrics is not None:
+            metrics.flush()
+
+    summary.report(sys.stderr)
+    print(f"Общее время: {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()